@@ -1,16 +1,51 @@
+import os
+import time
+import logging
+import secrets
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from passlib.context import CryptContext
 from models import User
 from database import SessionLocal
 from jose import JWTError, jwt
+from utils.inference_executor import InferenceExecutor, QueueFullError
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# JWT secret key and algorithm
-SECRET_KEY = "mysecret"
+# JWT secret key and algorithm. Bearer tokens are the only access control for
+# reports, images, profiles and admin exports, so there is no shared default:
+# without JWT_SECRET_KEY each process signs with its own random key, and tokens
+# do not survive a restart or work across workers
+SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+if not SECRET_KEY:
+    SECRET_KEY = secrets.token_urlsafe(32)
+    logging.warning("JWT_SECRET_KEY is not set; signing tokens with a random per-process key. "
+                    "Set JWT_SECRET_KEY in production or logins will not survive a restart.")
 ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+
+# bcrypt runs on its own small pool so a login storm cannot take the threads the
+# event loop and inference use; logins beyond the queue are rejected with 503
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+AUTH_HASH_MAX_QUEUE = int(os.getenv("AUTH_HASH_MAX_QUEUE", "32"))
+AUTH_RETRY_AFTER_S = int(os.getenv("AUTH_RETRY_AFTER_S", "1"))
+
+# Users resolved from tokens are cached briefly so authenticated requests skip the database
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "4096"))
+AUTH_USER_CACHE_TTL_S = float(os.getenv("AUTH_USER_CACHE_TTL_S", "60"))
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+# Same scheme for endpoints that also serve anonymous callers
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
+hash_executor = InferenceExecutor(AUTH_HASH_WORKERS, AUTH_HASH_MAX_QUEUE, name="bcrypt")
 
 def get_db():
     db = SessionLocal()
@@ -28,18 +63,143 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def _run_hash(fn, *args):
+    try:
+        with hash_executor.admit():
+            return await hash_executor.run(fn, *args)
+    except QueueFullError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many logins, please retry",
+                            headers={"Retry-After": str(AUTH_RETRY_AFTER_S)})
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_hash(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run_hash(get_password_hash, password)
+
 # User registration
-def create_user(db: Session, email: str, password: str):
-    hashed_password = get_password_hash(password)
+async def create_user(db: Session, email: str, password: str):
+    hashed_password = await get_password_hash_async(password)
     new_user = User(email=email, password=hashed_password)
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
     return new_user
 
-# User login (simplified for brevity, normally JWT tokens would be used)
-def authenticate_user(db: Session, email: str, password: str):
+async def authenticate_user(db: Session, email: str, password: str):
     user = get_user_by_email(db, email)
-    if not user or not verify_password(password, user.password):
+    if not user or not await verify_password_async(password, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     return user
+
+def create_access_token(data: dict, expires_delta: timedelta = None):
+    """
+    Signs a JWT carrying `data`; "sub" should be the user id as a string.
+    """
+    now = datetime.now(timezone.utc)
+    claims = {**data, "iat": now, "exp": now + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))}
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+def create_user_token(user: User):
+    return create_access_token({"sub": str(user.id), "admin": bool(user.is_admin)})
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """
+    Detached copy of the User fields routes need, safe to cache across requests.
+    """
+    id: int
+    email: str
+    username: str
+    is_admin: bool
+
+
+class UserCache:
+    """
+    Small LRU of AuthenticatedUser records with a TTL, keyed by user id.
+    """
+    def __init__(self, max_entries=AUTH_USER_CACHE_SIZE, ttl_seconds=AUTH_USER_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            stored_at, user = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[user.id] = (time.monotonic(), user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+user_cache = UserCache()
+
+def invalidate_user(user_id: int):
+    """
+    Drops a cached user so the next request with their token goes to the database
+    (and fails once the user is deleted).
+    """
+    user_cache.invalidate(user_id)
+
+def _load_user(user_id):
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is None:
+            return None
+        return AuthenticatedUser(id=user.id, email=user.email, username=user.username, is_admin=bool(user.is_admin))
+    finally:
+        db.close()
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> AuthenticatedUser:
+    """
+    Resolves the bearer token to a user. The signature and expiry are checked
+    locally; the database is only consulted on a user cache miss.
+    """
+    credentials_error = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials",
+                                      headers={"WWW-Authenticate": "Bearer"})
+    try:
+        user_id = int(jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"])
+    except (JWTError, KeyError, ValueError):
+        raise credentials_error
+
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await asyncio.to_thread(_load_user, user_id)
+        if user is None:
+            raise credentials_error
+        user_cache.put(user)
+    return user
+
+async def get_optional_user(token: str = Depends(optional_oauth2_scheme)) -> Optional[AuthenticatedUser]:
+    """
+    The caller when a bearer token is sent, None for anonymous requests. An invalid
+    token is still rejected rather than silently treated as anonymous.
+    """
+    if token is None:
+        return None
+    return await get_current_user(token)
+
+async def get_current_admin(current_user: AuthenticatedUser = Depends(get_current_user)) -> AuthenticatedUser:
+    if not current_user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user
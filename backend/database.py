@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -15,8 +15,34 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# SQLite write-ahead logging lets readers run alongside the single writer, and
+# synchronous=NORMAL skips the fsync per commit (WAL stays consistent on crash)
+SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() == "true"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Connection pool settings; unset values keep SQLAlchemy's defaults
+POOL_SETTINGS = {
+    name: int(os.environ[env])
+    for name, env in (("pool_size", "DB_POOL_SIZE"), ("max_overflow", "DB_MAX_OVERFLOW"),
+                      ("pool_timeout", "DB_POOL_TIMEOUT"), ("pool_recycle", "DB_POOL_RECYCLE"))
+    if os.getenv(env)
+}
+
 # Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if IS_SQLITE else {},
+                       pool_pre_ping=not IS_SQLITE, **POOL_SETTINGS)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        if SQLITE_WAL:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 
 # Create a sessionmaker factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -1,26 +1,65 @@
 import os
+import time
+import asyncio
 import logging
-import uuid
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form
+from typing import List
+from datetime import datetime, date
+from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form, Header, Query, Request, WebSocket
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
-from models import User, Report, Base  # Add Base
-from database import engine, get_db  # Import engine to bind metadata
-from auth import create_user, authenticate_user, get_user_by_email
-from utils.ml_integration import predict_disease
-from datetime import datetime, timezone
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, FileResponse
+from models import Base
+from database import engine, get_db, SessionLocal  # Import engine to bind metadata
+from auth import (create_user, authenticate_user, get_user_by_email, create_user_token, get_current_admin,
+                  get_current_user, get_optional_user, AuthenticatedUser)
+from utils.ml_integration import (predict_disease_async, scheduler, executor, prediction_cache,
+                                  start_model_warmup, serving_stats, warmup, AUTO_CROP_TYPE)
+from utils.inference_executor import QueueFullError, DeadlineExceededError, deadline_after, INFERENCE_RETRY_AFTER_S
+from utils.batch_upload import iter_uploaded_files, iter_zip_members, stream_batch_predictions
+from utils.reports import build_report
+from utils.near_duplicates import upload_index
+from utils.streaming import StreamSession, stream_sessions
+from utils.ingest import ingest_upload, UploadRejectedError, UploadSizeLimitMiddleware
+from utils.image_store import image_store, file_response
+from utils.exports import ExportRequest, user_export_request, report_export_request
+from utils.profiling import profiler
+from utils.metrics import metrics_registry, stage_seconds, errors, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from utils.report_queries import query_reports, parse_columns, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils import rollups
+from utils.report_writer import ReportWriter, REPORT_DURABILITY
+from migrations import run_migrations
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and warm the configured hot set of models (MODEL_PRELOAD), or the
+    # combined multi-crop model; in background mode /health/ready tracks progress
+    start_model_warmup()
+    yield
+    # Write out reports still queued by the write-behind writer
+    report_writer.drain()
+
+app = FastAPI(lifespan=lifespan)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-# Ensure temp directory exists
-TEMP_DIR = "temp"
-os.makedirs(TEMP_DIR, exist_ok=True)
+# Crop types accepted by the upload endpoints; "auto" lets the models pick the crop
+VALID_CROP_TYPES = ['corn', 'grape', 'tomato', 'apple', 'cherry', AUTO_CROP_TYPE]
+
+# Uploaded images are only stored (once per unique image, see utils/image_store.py)
+# when the client asks to keep them
+KEEP_UPLOADED_IMAGES = os.getenv("KEEP_UPLOADED_IMAGES", "false").lower() == "true"
 
 # Create the database tables if they don't exist
 Base.metadata.create_all(bind=engine)  # This line creates the tables
+# Add indexes/columns that create_all does not apply to existing tables
+run_migrations(engine)
+# Keep the disease rollups in step with every Report insert/delete
+rollups.install(SessionLocal)
+
+# Write-behind queue used when REPORT_DURABILITY=batched
+report_writer = ReportWriter()
 
 # Configure CORS
 app.add_middleware(
@@ -31,73 +70,310 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Refuse oversized single-image uploads before their body is received
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/upload-image/"])
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the AI Crop Disease App"}
 
+# Liveness: the process is up and the event loop answers
+@app.get("/health/live")
+def health_live():
+    return {"status": "ok"}
+
+# Readiness: every startup model (MODEL_PRELOAD, or all crops when unset) is loaded
+# and warmed; the body has each model's state, "lazy" for crops loaded on first use
+@app.get("/health/ready")
+def health_ready():
+    status = warmup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 @app.post("/register")
-def register(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+async def register(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
     if get_user_by_email(db, email):
         raise HTTPException(status_code=400, detail="Email already registered")
-    return create_user(db, email, password)
+    return await create_user(db, email, password)
 
+# Password hashing runs on the auth pool (see auth.py), never on the event loop
 @app.post("/login")
-def login(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    return authenticate_user(db, email, password)
+async def login(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+    user = await authenticate_user(db, email, password)
+    return {"message": "Login successful", "access_token": create_user_token(user), "token_type": "bearer",
+            "user_id": user.id}
+
+@app.get("/reports")
+def list_reports(crop_type: str = None, disease: str = None,
+                 start: datetime = None, end: datetime = None, cursor: str = None,
+                 limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), fields: str = None,
+                 current_user: AuthenticatedUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    The caller's report history, newest first. Pass the returned next_cursor to
+    get the next page; fields is a comma-separated list of columns to return.
+    """
+    try:
+        reports, next_cursor = query_reports(db, user_id=current_user.id, crop_type=crop_type, disease=disease,
+                                             start=start, end=end, cursor=cursor, limit=limit,
+                                             columns=parse_columns(fields))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"reports": reports, "next_cursor": next_cursor}
+
+@app.get("/reports/{report_uid}")
+def get_report(report_uid: str, current_user: AuthenticatedUser = Depends(get_current_user),
+               db: Session = Depends(get_db)):
+    # Other users' reports are reported as missing rather than forbidden
+    reports, _ = query_reports(db, uid=report_uid, user_id=current_user.id, limit=1)
+    if reports:
+        return reports[0]
+    if report_writer.is_pending(report_uid, current_user.id):
+        return JSONResponse(status_code=202, content={"uid": report_uid, "status": "pending"})
+    raise HTTPException(status_code=404, detail="Report not found")
+
+# Streaming admin exports: CSV or NDJSON, optionally gzipped, in constant memory
+@app.get("/admin/export/users")
+def export_users(export: ExportRequest = Depends(user_export_request), admin=Depends(get_current_admin)):
+    return export.response()
+
+@app.get("/admin/export/reports")
+def export_reports(export: ExportRequest = Depends(report_export_request), admin=Depends(get_current_admin)):
+    return export.response()
+
+# Stored CPU/allocation profiles of profiled uploads (see utils/profiling.py)
+@app.get("/admin/profiles")
+def list_profiles(admin=Depends(get_current_admin)):
+    return {"profiles": profiler.list()}
+
+@app.get("/admin/profiles/{name}")
+def download_profile(name: str, admin=Depends(get_current_admin)):
+    try:
+        path = profiler.path_for(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=name)
+
+# Stored images and their thumbnails, addressed by sha256
+@app.get("/images/{digest}")
+def get_image(digest: str, request: Request):
+    return _stored_image_response(digest, request, thumbnail=False)
+
+@app.get("/images/{digest}/thumbnail")
+def get_thumbnail(digest: str, request: Request):
+    return _stored_image_response(digest, request, thumbnail=True)
+
+def _stored_image_response(digest, request, thumbnail):
+    try:
+        path = image_store.path_for(digest, thumbnail=thumbnail)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return file_response(path, f"{digest}-thumb" if thumbnail else digest,
+                         range_header=request.headers.get("range"),
+                         if_none_match=request.headers.get("if-none-match"))
+
+# Disease counts per crop and day, answered from the rollup table
+@app.get("/analytics/diseases")
+def disease_analytics(start: date = None, end: date = None, crop_type: str = None,
+                      top: int = Query(10, ge=1, le=100), db: Session = Depends(get_db)):
+    return rollups.query_rollups(db, start=start, end=end, crop_type=crop_type, top=top)
 
 @app.post("/upload-image/")
-async def upload_image(crop_type: str = Form(...), file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_image(crop_type: str = Form(...), file: UploadFile = File(...),
+                       keep_image: bool = Form(KEEP_UPLOADED_IMAGES), db: Session = Depends(get_db),
+                       x_request_timeout: float = Header(None), x_profile_token: str = Header(None),
+                       current_user: AuthenticatedUser = Depends(get_optional_user)):
     logging.info("Image upload initiated")
+    # Signed-in uploads are attributed to the user and may reuse their earlier predictions
+    user_id = current_user.id if current_user else None
+    started = time.perf_counter()
+    # Per-request deadline; queued work is dropped once the client has given up
+    deadline = deadline_after(x_request_timeout)
     logging.info(f"Received crop type: '{crop_type}'")
 
-    # Define valid crop types
-    valid_crop_types = ['corn', 'grape', 'tomato', 'apple', 'cherry']
-    
     # Validate crop type
-    if crop_type not in valid_crop_types:
+    if crop_type not in VALID_CROP_TYPES:
         logging.error(f"Invalid crop type provided: '{crop_type}'")
+        errors.inc(type="invalid_crop_type")
         raise HTTPException(status_code=400, detail="Invalid crop type provided")
     
-    # Generate a unique filename to avoid overwriting
-    filename = f"{uuid.uuid4()}.jpg"  # Adjust extension based on actual file type
-    file_location = os.path.join(TEMP_DIR, filename)
-
-    # Save the uploaded file temporarily
+    # Read the upload in chunks under the size cap, validating the header and hashing
+    # as it arrives; the image is decoded straight from this one buffer
     try:
-        with open(file_location, "wb") as buffer:
-            buffer.write(await file.read())
-        logging.info(f"Image saved to {file_location}")
+        with stage_seconds.time(stage="upload_read", crop_type=crop_type):
+            upload = await ingest_upload(file)
+    except UploadRejectedError as e:
+        logging.warning(f"Upload rejected: {e.detail}")
+        errors.inc(type="upload_rejected")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
-        logging.error(f"Failed to save image: {e}")
-        raise HTTPException(status_code=500, detail="Failed to save image")
+        logging.error(f"Failed to read image: {e}")
+        errors.inc(type="upload_read")
+        raise HTTPException(status_code=500, detail="Failed to read image")
+    contents, digest = upload.data, upload.digest
+
+    # Only persist the image when explicitly requested; identical images are stored once
+    image_path = None
+    if keep_image:
+        try:
+            await asyncio.to_thread(image_store.put, contents, digest)
+            image_path = f"images/{digest}"
+            logging.info(f"Image stored as {digest}")
+        except Exception as e:
+            logging.error(f"Failed to save image: {e}")
+            errors.inc(type="image_store")
+            raise HTTPException(status_code=500, detail="Failed to save image")
 
     # Call the ML model to predict the disease
     try:
+        # Profiled uploads take the same path; only their decode and forward pass run
+        # inline on one executor thread, under the profiler
+        profile_name = f"upload-{crop_type}" if profiler.requested(x_profile_token) else None
+        if profile_name:
+            logging.info("Profiling this upload")
         logging.info("Starting prediction with the ML model...")
-        result = predict_disease(crop_type, file_location)
+        try:
+            result = await predict_disease_async(crop_type, contents, deadline=deadline, image_hash=digest,
+                                                 user_id=user_id, profile_name=profile_name)
+        except QueueFullError:
+            logging.warning("Inference queue full, rejecting upload")
+            errors.inc(type="queue_full")
+            raise HTTPException(status_code=503, detail="Server is busy, please retry later",
+                                headers={"Retry-After": str(INFERENCE_RETRY_AFTER_S)})
+        except DeadlineExceededError:
+            logging.warning("Inference deadline exceeded")
+            errors.inc(type="deadline_exceeded")
+            raise HTTPException(status_code=504, detail="Prediction timed out")
         logging.info(f"Prediction complete: {result}")
 
-        # Create and save the report
-        report = Report(
-            crop_type=crop_type,
-            image_path=file_location,
-            predicted_disease=result.get("disease", "Unknown"),
-            solution=result.get("solution", {}).get("Preventive Measures", "No preventive measures provided"),
-            timestamp=datetime.now(timezone.utc)  # Use timezone-aware datetime
-        )
-        db.add(report)
-        db.commit()
-        db.refresh(report)
+        # Create and save the report; in batched mode it is written after responding
+        report = build_report(crop_type, result, image_path=image_path, user_id=user_id,
+                              image_hash=digest if keep_image else None)
+        with stage_seconds.time(stage="db_commit", crop_type=crop_type):
+            report_id, report_uid = _save_report(db, report)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Image processing failed: {e}")
+        errors.inc(type="internal")
         raise HTTPException(status_code=500, detail=f"Image processing failed: {e}")
+
+    stage_seconds.observe(time.perf_counter() - started, stage="total", crop_type=crop_type)
+    # report_id is only known once the row is written; report_uid is stable either way
+    return {"message": "Image processed successfully", "result": result,
+            "report_id": report_id, "report_uid": report_uid}
+
+def _save_report(db, report):
+    """
+    Commits the report (or queues it in batched mode) and returns (id, uid).
+    The writer thread owns a submitted report, so it is not touched afterwards.
+    """
+    if REPORT_DURABILITY == "batched":
+        return None, report_writer.submit(report)
+    db.add(report)
+    db.commit()
+    db.refresh(report)
+    return report.id, report.uid
+
+def _save_report_in_session(report):
+    db = SessionLocal()
+    try:
+        return _save_report(db, report)[1]
     finally:
-        # Clean up the temp file
-        if os.path.exists(file_location):
-            os.remove(file_location)
-            logging.info(f"Temporary image file {file_location} removed")
+        db.close()
+
+async def _save_stream_report(report):
+    if REPORT_DURABILITY == "batched":
+        return report_writer.submit(report)
+    return await asyncio.to_thread(_save_report_in_session, report)
+
+# Continuous camera frames over a WebSocket; the protocol is described in utils/streaming.py.
+# Browsers cannot set headers on a WebSocket, so the bearer token comes as a query parameter
+@app.websocket("/stream")
+async def stream_predictions(websocket: WebSocket, crop_type: str, token: str = None):
+    user_id = None
+    if token:
+        try:
+            user_id = (await get_current_user(token)).id
+        except HTTPException:
+            await websocket.close(code=1008, reason="Could not validate credentials")
+            return
+    if crop_type not in VALID_CROP_TYPES:
+        await websocket.close(code=1008, reason="Invalid crop type provided")
+        return
+
+    session = StreamSession(websocket, crop_type, _save_stream_report, user_id=user_id)
+    if not stream_sessions.open(session):
+        await websocket.close(code=1013, reason="Too many open streams, please retry later")
+        return
+    await websocket.accept()
+    logging.info(f"Stream opened for '{crop_type}'")
+    try:
+        await session.run()
+    finally:
+        stream_sessions.close(session)
+
+@app.post("/upload-images/batch")
+async def upload_images_batch(files: List[UploadFile] = File(None), archive: UploadFile = File(None),
+                              crop_type: str = Form(None), crop_types: List[str] = Form(None),
+                              current_user: AuthenticatedUser = Depends(get_optional_user)):
+    """
+    Scores many images in one request, given as a multipart list of files and/or a
+    zip archive. `crop_type` applies to every image unless `crop_types` (one per
+    file) or a crop-named top-level folder in the archive says otherwise. Results
+    are streamed back as NDJSON while the batch is processed. Signed-in batches are
+    attributed to the user, as single uploads are.
+    """
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="No files or archive provided")
+    for requested in [crop_type] + (crop_types or []):
+        if requested is not None and requested not in VALID_CROP_TYPES:
+            raise HTTPException(status_code=400, detail=f"Invalid crop type provided: '{requested}'")
+
+    async def items():
+        if files:
+            async for item in iter_uploaded_files(files, crop_types, crop_type):
+                yield item
+        if archive is not None:
+            async for item in iter_zip_members(archive, crop_type, VALID_CROP_TYPES):
+                yield item
+
+    logging.info(f"Batch upload initiated ({len(files or [])} files, archive: {archive is not None})")
+    user_id = current_user.id if current_user else None
+    return StreamingResponse(stream_batch_predictions(items(), VALID_CROP_TYPES, user_id),
+                             media_type="application/x-ndjson")
+
+# Prometheus scrape endpoint: per-stage latency histograms, resource gauges, error counters
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+# Batching counters, useful for tuning BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS
+@app.get("/inference/stats")
+def inference_stats():
+    return {**scheduler.stats(), "executor": executor.stats()}
+
+# Resident models with their load time and memory footprint
+@app.get("/models/stats")
+def model_stats():
+    return serving_stats()
+
+# Write-behind report queue depth and flush counters
+@app.get("/report-writer/stats")
+def report_writer_stats():
+    return report_writer.stats()
+
+# Open streams and per-outcome frame counters
+@app.get("/stream/stats")
+def stream_stats():
+    return stream_sessions.stats()
 
-    return {"message": "Image processed successfully", "result": result, "report_id": report.id}
+# Prediction cache hit/miss/eviction counters
+@app.get("/cache/stats")
+def cache_stats():
+    stats = prediction_cache.stats()
+    stats["near_duplicates"] = upload_index.stats()
+    return stats
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,63 @@
+"""
+Brings an existing database up to the current models. create_all() only creates
+missing tables, so indexes and columns added to existing tables are applied here.
+
+Runs at startup from main.py, or by hand from the backend directory:
+    python -m migrations
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from database import engine, Base
+from models import Report, User
+from utils.rollups import backfill_if_empty
+
+
+def ensure_columns(table, bind=engine):
+    """
+    Adds the columns declared on `table` that the database does not have yet.
+    Constraints such as uniqueness come from the column's index (ensure_indexes).
+    """
+    existing = {column["name"] for column in inspect(bind).get_columns(table.name)}
+    added = []
+    with bind.begin() as connection:
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=bind.dialect)
+                logging.info(f"Adding column {table.name}.{column.name}")
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+                added.append(column.name)
+    return added
+
+
+def ensure_indexes(table, bind=engine):
+    """
+    Creates the indexes declared on `table` that the database does not have yet.
+    """
+    existing = {index["name"] for index in inspect(bind).get_indexes(table.name)}
+    created = []
+    for index in table.indexes:
+        if index.name not in existing:
+            logging.info(f"Creating index {index.name} on {table.name}")
+            index.create(bind=bind)
+            created.append(index.name)
+    return created
+
+
+def run_migrations(bind=engine):
+    """
+    Applies every migration; each one is a no-op when already applied.
+    """
+    Base.metadata.create_all(bind=bind)
+    columns, indexes = [], []
+    for table in (User.__table__, Report.__table__):
+        columns += [f"{table.name}.{name}" for name in ensure_columns(table, bind)]
+        indexes += ensure_indexes(table, bind)
+    with Session(bind) as db:
+        rollup_rows = backfill_if_empty(db)
+    return {"columns": columns, "indexes": indexes, "rollup_rows": rollup_rows}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(run_migrations())
@@ -1,14 +1,17 @@
-from sqlalchemy import Column, DateTime, Integer, String, ForeignKey
+from sqlalchemy import Boolean, Column, Date, DateTime, Integer, String, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime, timezone  # Import timezone for UTC
+import uuid
 
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True)
+    username = Column(String, unique=True, index=True)
     password = Column(String)  # Password will be hashed
+    is_admin = Column(Boolean, default=False)
     registered_on = Column(DateTime, default=lambda: datetime.now(timezone.utc))  # Timezone-aware UTC
 
     # Relationship with Report
@@ -19,8 +22,11 @@ class Report(Base):
     __tablename__ = "reports"
 
     id = Column(Integer, primary_key=True, index=True)
+    # Stable identifier handed to clients before the row is written (see utils/report_writer.py)
+    uid = Column(String, unique=True, index=True, default=lambda: uuid.uuid4().hex)
     crop_type = Column(String, index=True)
     image_path = Column(String)
+    image_hash = Column(String, index=True)  # sha256 of the image in utils/image_store.py
     predicted_disease = Column(String)
     solution = Column(String)
     timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))  # Add timestamp with UTC
@@ -28,3 +34,38 @@ class Report(Base):
 
     # Relationship with User
     user = relationship("User", back_populates="reports")
+
+    # Keyset pagination walks (timestamp, id) newest first, optionally inside one
+    # user's history and one crop or disease; existing databases get these from
+    # migrations.py
+    __table_args__ = (
+        Index("ix_reports_timestamp_id", "timestamp", "id"),
+        Index("ix_reports_user_timestamp_id", "user_id", "timestamp", "id"),
+        Index("ix_reports_user_crop_timestamp_id", "user_id", "crop_type", "timestamp", "id"),
+        Index("ix_reports_user_disease_timestamp_id", "user_id", "predicted_disease", "timestamp", "id"),
+    )
+
+
+class PredictionCacheEntry(Base):
+    __tablename__ = "prediction_cache"
+
+    key = Column(String, primary_key=True)  # sha256(image):crop_type:model_version
+    crop_type = Column(String, index=True)
+    model_version = Column(String)
+    result = Column(Text)  # JSON-encoded prediction result
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class DiseaseRollup(Base):
+    __tablename__ = "disease_rollups"
+
+    # One row per crop, predicted disease and UTC day, kept in step with reports
+    # by utils/rollups.py
+    crop_type = Column(String, primary_key=True)
+    predicted_disease = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_disease_rollups_day", "day"),
+    )
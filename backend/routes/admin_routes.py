@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from backend import models, database, auth
 from pydantic import BaseModel
+from utils.exports import ExportRequest, user_export_request, report_export_request
 
 router = APIRouter()
 
@@ -14,29 +15,39 @@ class AdminLogin(BaseModel):
 @router.post('/admin/login')
 async def admin_login(admin_data: AdminLogin, db: Session = Depends(database.get_db)):
     admin_user = db.query(models.User).filter(models.User.username == admin_data.username, models.User.is_admin == True).first()
-    if not admin_user or not auth.verify_password(admin_data.password, admin_user.password):
+    if not admin_user or not await auth.verify_password_async(admin_data.password, admin_user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
-    # Generate an admin JWT token here (optional)
-    token = auth.create_access_token({"sub": admin_user.username, "admin": True})
+    token = auth.create_user_token(admin_user)
     
     return {"message": "Admin login successful", "token": token}
 
 # Admin route to fetch all users
 @router.get('/admin/users')
-async def get_all_users(db: Session = Depends(database.get_db)):
+async def get_all_users(db: Session = Depends(database.get_db), admin=Depends(auth.get_current_admin)):
     users = db.query(models.User).all()
     
     return {"message": "All users fetched successfully", "users": users}
 
+# Admin routes to stream every user or report as CSV/NDJSON (optionally gzipped)
+@router.get('/admin/export/users')
+def export_users(export: ExportRequest = Depends(user_export_request), admin=Depends(auth.get_current_admin)):
+    return export.response()
+
+@router.get('/admin/export/reports')
+def export_reports(export: ExportRequest = Depends(report_export_request), admin=Depends(auth.get_current_admin)):
+    return export.response()
+
 # Admin route to delete a user
 @router.delete('/admin/user/{user_id}')
-async def delete_user(user_id: int, db: Session = Depends(database.get_db)):
+async def delete_user(user_id: int, db: Session = Depends(database.get_db), admin=Depends(auth.get_current_admin)):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     
     db.delete(user)
     db.commit()
+    # Tokens stay valid until they expire, so drop the cached user to reject them now
+    auth.invalidate_user(user_id)
     
     return {"message": "User deleted successfully"}
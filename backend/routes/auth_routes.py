@@ -17,7 +17,7 @@ class UserLogin(BaseModel):
 # User registration
 @router.post('/register')
 async def register_user(user_data: UserRegister, db: Session = Depends(database.get_db)):
-    hashed_password = auth.get_password_hash(user_data.password)
+    hashed_password = await auth.get_password_hash_async(user_data.password)
     new_user = models.User(username=user_data.username, password=hashed_password)
     
     db.add(new_user)
@@ -30,10 +30,9 @@ async def register_user(user_data: UserRegister, db: Session = Depends(database.
 @router.post('/login')
 async def login_user(user_data: UserLogin, db: Session = Depends(database.get_db)):
     user = db.query(models.User).filter(models.User.username == user_data.username).first()
-    if not user or not auth.verify_password(user_data.password, user.password):
+    if not user or not await auth.verify_password_async(user_data.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
-    # Generate a JWT token here (optional)
-    token = auth.create_access_token({"sub": user.username})
+    token = auth.create_user_token(user)
     
     return {"message": "Login successful", "token": token}
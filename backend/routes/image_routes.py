@@ -1,65 +1,42 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Header
 from pydantic import BaseModel
-import shutil
-import os
-from utils.ml_integration import load_model, predict_image
+from utils.ml_integration import is_supported_crop, predict_disease_async
+from utils.ingest import ingest_upload, UploadRejectedError
+from utils.inference_executor import QueueFullError, DeadlineExceededError, deadline_after, INFERENCE_RETRY_AFTER_S
 
 router = APIRouter()
 
-# Dictionary to store the paths to the pre-trained models
-MODEL_PATHS = {
-    "apple": "C:/AI-Crop-Disease-App/ml_model/model/apple_model/crop_disease_model_apple.keras",
-    "corn": "C:/AI-Crop-Disease-App/ml_model/model/corn_model/crop_disease_model_corn1.keras",
-    "cherry": "C:/AI-Crop-Disease-App/ml_model/model/cherry_model/crop_disease_model_cherry.keras",
-    "grape": "C:/AI-Crop-Disease-App/ml_model/model/grape_model/crop_disease_model_grape.keras",
-    "tomato": "C:/AI-Crop-Disease-App/ml_model/model/tomato_model/crop_disease_model_tomato.keras"
-}
-
-# Load models only once during startup
-loaded_models = {}
-
-def get_model(crop_type):
-    if crop_type not in loaded_models:
-        model_path = MODEL_PATHS.get(crop_type)
-        if not model_path:
-            raise HTTPException(status_code=400, detail="Invalid crop type")
-        try:
-            loaded_models[crop_type] = load_model(model_path)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to load model: {str(e)}")
-    return loaded_models[crop_type]
-
-# Ensure the temporary directory exists
-os.makedirs("temp_images", exist_ok=True)
+# Models come from the shared registry in utils/ml_integration.py, so this router
+# and the main upload endpoint never hold separate copies of the same model
 
 @router.post("/upload-image/")
-async def upload_image(cropType: str = Form(...), image: UploadFile = File(...)):
+async def upload_image(cropType: str = Form(...), image: UploadFile = File(...),
+                       x_request_timeout: float = Header(None)):
     # Check if cropType is valid
-    if cropType not in MODEL_PATHS:
+    if not is_supported_crop(cropType):
         raise HTTPException(status_code=400, detail="Invalid crop type selected")
 
-    # Save uploaded file temporarily
-    image_path = f"temp_images/{image.filename}"
+    deadline = deadline_after(x_request_timeout)
     try:
-        with open(image_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-
-        # Load the appropriate model for the crop type
-        model = get_model(cropType)
-
-        # Run prediction on the uploaded image
-        predicted_disease, solution = predict_image(model, image_path)
+        upload = await ingest_upload(image)
+    except UploadRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
+    try:
+        # Decode the validated upload straight from memory and run prediction on it
+        result = await predict_disease_async(cropType, upload.data, deadline=deadline, image_hash=upload.digest)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry later",
+                            headers={"Retry-After": str(INFERENCE_RETRY_AFTER_S)})
+    except DeadlineExceededError:
+        raise HTTPException(status_code=504, detail="Prediction timed out")
     except Exception as e:
-        if os.path.exists(image_path):
-            os.remove(image_path)  # Cleanup if something goes wrong
         raise HTTPException(status_code=500, detail=f"Error processing the image: {str(e)}")
 
-    # Remove the temporary file after processing
-    if os.path.exists(image_path):
-        os.remove(image_path)
-
     return {
-        "predicted_disease": predicted_disease,
-        "solution": solution
+        "predicted_disease": result["disease"],
+        "solution": result["solution"]
     }
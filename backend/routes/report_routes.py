@@ -1,13 +1,23 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
+from datetime import datetime
 from backend import models, database
 from backend.auth import get_current_user
+from utils.report_queries import query_reports, parse_columns, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 router = APIRouter()
 
-# Fetch user reports
+# Fetch user reports, one keyset page at a time
 @router.get('/reports')
-async def fetch_user_reports(current_user: models.User = Depends(get_current_user), db: Session = Depends(database.get_db)):
-    reports = db.query(models.Report).filter(models.Report.user_id == current_user.id).all()
-    
-    return {"message": "User reports fetched successfully", "reports": reports}
+async def fetch_user_reports(crop_type: str = None, disease: str = None,
+                             start: datetime = None, end: datetime = None, cursor: str = None,
+                             limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), fields: str = None,
+                             current_user: models.User = Depends(get_current_user), db: Session = Depends(database.get_db)):
+    try:
+        reports, next_cursor = query_reports(db, user_id=current_user.id, crop_type=crop_type, disease=disease,
+                                             start=start, end=end, cursor=cursor, limit=limit,
+                                             columns=parse_columns(fields))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"message": "User reports fetched successfully", "reports": reports, "next_cursor": next_cursor}
@@ -0,0 +1,154 @@
+import os
+import json
+import asyncio
+import logging
+import zipfile
+from database import SessionLocal
+from utils.ml_integration import predict_disease_async
+from utils.inference_executor import QueueFullError, DeadlineExceededError, deadline_after, INFERENCE_RETRY_AFTER_S
+from utils.reports import build_report
+from utils.ingest import ingest_upload, ingest_bytes, UploadRejectedError
+
+# How many images are decoded/scored concurrently; this bounds memory use no
+# matter how many files or archive members the request contains
+BATCH_UPLOAD_WINDOW = int(os.getenv("BATCH_UPLOAD_WINDOW", "32"))
+# Largest single image accepted in a batch (uncompressed, for archive members)
+BATCH_UPLOAD_MAX_IMAGE_BYTES = int(os.getenv("BATCH_UPLOAD_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+async def iter_uploaded_files(files, crop_types, default_crop):
+    """
+    Yields (filename, crop_type, image) for a multipart list of files, reading one
+    at a time; image is an IngestedImage, or the UploadRejectedError it failed with.
+    """
+    for i, upload in enumerate(files):
+        crop_type = crop_types[i] if crop_types and i < len(crop_types) else default_crop
+        try:
+            image = await ingest_upload(upload, BATCH_UPLOAD_MAX_IMAGE_BYTES)
+        except UploadRejectedError as e:
+            image = e
+        await upload.close()
+        yield upload.filename, crop_type, image
+
+
+async def iter_zip_members(archive, default_crop, valid_crop_types):
+    """
+    Yields (filename, crop_type, image) for every image in a zip archive, one
+    member at a time. A top-level folder named after a crop type sets the crop
+    for the images inside it; other images use `default_crop`.
+    """
+    zf = await asyncio.to_thread(zipfile.ZipFile, archive.file)
+    try:
+        for info in zf.infolist():
+            if info.is_dir() or os.path.splitext(info.filename)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            folder = info.filename.split("/", 1)[0].lower() if "/" in info.filename else None
+            crop_type = folder if folder in valid_crop_types else default_crop
+            if info.file_size > BATCH_UPLOAD_MAX_IMAGE_BYTES:
+                yield info.filename, crop_type, UploadRejectedError(413, "Image exceeds the size limit")
+                continue
+            try:
+                image = ingest_bytes(await asyncio.to_thread(zf.read, info), BATCH_UPLOAD_MAX_IMAGE_BYTES)
+            except UploadRejectedError as e:
+                image = e
+            yield info.filename, crop_type, image
+    finally:
+        zf.close()
+
+
+async def _predict_with_backpressure(crop_type, image):
+    # Wait for capacity instead of failing the whole batch when the executor is full
+    while True:
+        try:
+            return await predict_disease_async(crop_type, image.data, deadline=deadline_after(),
+                                               image_hash=image.digest)
+        except QueueFullError:
+            await asyncio.sleep(INFERENCE_RETRY_AFTER_S)
+
+
+async def _score_item(index, filename, crop_type, image, valid_crop_types):
+    line = {"index": index, "filename": filename, "crop_type": crop_type}
+    if crop_type not in valid_crop_types:
+        line["error"] = "Invalid or missing crop type"
+    elif isinstance(image, UploadRejectedError):
+        line["error"] = image.detail
+    else:
+        try:
+            result = await _predict_with_backpressure(crop_type, image)
+        except DeadlineExceededError:
+            result = {"error": "Prediction timed out"}
+        if "error" in result:
+            line["error"] = result["error"]
+        else:
+            line["result"] = result
+    return line
+
+
+async def stream_batch_predictions(items, valid_crop_types, user_id=None):
+    """
+    Scores `items` (an async iterator of (filename, crop_type, image)) in windows
+    of BATCH_UPLOAD_WINDOW images and yields one NDJSON line per image as each
+    window completes. Each window's Report rows (owned by `user_id`) are committed
+    in one short transaction before its lines are sent, so no write lock is held
+    while the client reads; the final line summarises the batch.
+    """
+    processed = failed = saved = 0
+    index = 0
+    window = []
+    async for filename, crop_type, image in items:
+        window.append(_score_item(index, filename, crop_type, image, valid_crop_types))
+        index += 1
+        if len(window) >= BATCH_UPLOAD_WINDOW:
+            async for line in _flush_window(window, user_id):
+                failed += "error" in line
+                saved += "report_id" in line
+                processed += 1
+                yield json.dumps(line) + "\n"
+            window = []
+    if window:
+        async for line in _flush_window(window, user_id):
+            failed += "error" in line
+            saved += "report_id" in line
+            processed += 1
+            yield json.dumps(line) + "\n"
+
+    yield json.dumps({"done": True, "processed": processed, "failed": failed, "reports": saved}) + "\n"
+
+
+def _commit_reports(reports):
+    """
+    Inserts `reports` in one transaction and returns their ids.
+    """
+    db = SessionLocal()
+    try:
+        db.add_all(reports)
+        # Flush first so the ids can be read before commit expires the rows
+        db.flush()
+        ids = [report.id for report in reports]
+        db.commit()
+        return ids
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def _flush_window(window, user_id=None):
+    lines = await asyncio.gather(*window)
+    saved = [(line, build_report(line["crop_type"], line["result"], user_id=user_id))
+             for line in lines if "result" in line]
+    if saved:
+        try:
+            ids = await asyncio.to_thread(_commit_reports, [report for _, report in saved])
+        except Exception as e:
+            logging.error(f"Failed to save {len(saved)} batch report(s): {e}")
+            for line, _ in saved:
+                line["error"] = "Failed to save report"
+        else:
+            for (line, _), report_id in zip(saved, ids):
+                line["report_id"] = report_id
+    for line in lines:
+        yield line
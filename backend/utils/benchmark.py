@@ -0,0 +1,285 @@
+"""
+Latency/throughput benchmarks for the serving stack.
+
+Run from the backend directory:
+    python -m utils.benchmark --stub --output bench.json
+    python -m utils.benchmark --stub --compare bench.json
+    python -m utils.benchmark --stub --suites upload --database sqlite:////tmp/bench.db
+
+--stub replaces the Keras models with a deterministic stand-in that has the
+real input/output shapes, so the suite runs without the .keras files. Reports
+are written to a fresh temporary SQLite database unless --database names one.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+DEFAULT_CONCURRENCY = [1, 4, 16]
+DEFAULT_IMAGE_SIZES = ["640x480", "1920x1080", "4000x3000"]
+
+
+class StubModel:
+    """
+    Deterministic stand-in for a crop model: (n, 180, 180, 3) in, (n, num_classes)
+    softmax out. The output is a fixed random projection of per-image channel
+    statistics, so equal inputs always give equal predictions.
+    """
+    def __init__(self, num_classes, seed=0):
+        self.num_classes = num_classes
+        self._projection = np.random.default_rng(seed).standard_normal((6, num_classes)).astype(np.float32)
+
+    def predict(self, inputs, verbose=0):
+        inputs = np.asarray(inputs, dtype=np.float32)
+        features = np.concatenate([inputs.mean(axis=(1, 2)), inputs.std(axis=(1, 2))], axis=1)
+        logits = features @ self._projection
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    @property
+    def weights(self):
+        return []
+
+
+def install_stub_models(registry, class_names):
+    """
+    Points the registry at StubModel instances instead of the .keras files.
+    """
+    crop_for_path = {registry.artifact_path(crop): crop for crop in registry.crop_types()}
+    registry.loader = lambda path: StubModel(len(class_names[crop_for_path[path]]))
+    for crop_type in registry.crop_types():
+        registry.evict(crop_type)
+
+
+def synthetic_jpeg(size, seed=0):
+    """
+    Deterministic JPEG of `size` ("WIDTHxHEIGHT"): a colour gradient plus noise.
+    """
+    import cv2 as cv
+    width, height = (int(v) for v in size.split("x"))
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1),
+                    np.full_like(x, 96)], axis=-1).astype(np.int16)
+    img += rng.integers(-20, 20, img.shape, dtype=np.int16)
+    ok, encoded = cv.imencode(".jpg", np.clip(img, 0, 255).astype(np.uint8))
+    return encoded.tobytes()
+
+
+def summarize(latencies, elapsed):
+    latencies_ms = np.array(latencies) * 1000.0
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def run_threaded(fn, concurrency, requests):
+    """
+    Calls fn() `requests` times from `concurrency` threads and summarises the latencies.
+    """
+    def timed(_):
+        started = time.perf_counter()
+        fn()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        latencies = list(pool.map(timed, range(requests)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed)
+
+
+async def run_async(fn, concurrency, requests):
+    """
+    Awaits fn() `requests` times with at most `concurrency` in flight.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed():
+        async with semaphore:
+            started = time.perf_counter()
+            await fn()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed() for _ in range(requests)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def bench_preprocess(images, concurrency_levels, requests):
+    # prepare_frame is the decode/resize step the serving path runs per request
+    from utils.ml_integration import prepare_frame
+    return [
+        {"size": size, "concurrency": c, **run_threaded(lambda: prepare_frame(data), c, requests)}
+        for size, data in images.items() for c in concurrency_levels
+    ]
+
+
+def bench_predict(images, concurrency_levels, requests, crop_type):
+    from utils.ml_integration import predict_disease
+    results = []
+    for size, data in images.items():
+        for c in concurrency_levels:
+            def call():
+                result = predict_disease(crop_type, data)
+                if "error" in result:
+                    raise RuntimeError(result["error"])
+            results.append({"size": size, "concurrency": c, **run_threaded(call, c, requests)})
+    return results
+
+
+def bench_upload_route(images, concurrency_levels, requests, crop_type):
+    import httpx
+    import main
+
+    async def run():
+        results = []
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for size, data in images.items():
+                for c in concurrency_levels:
+                    async def call():
+                        response = await client.post("/upload-image/", data={"crop_type": crop_type},
+                                                     files={"file": ("bench.jpg", data, "image/jpeg")})
+                        if response.status_code != 200:
+                            raise RuntimeError(f"Upload failed with {response.status_code}: {response.text}")
+                    results.append({"size": size, "concurrency": c, **await run_async(call, c, requests)})
+        return results
+
+    return asyncio.run(run())
+
+
+def bench_report_insert(concurrency_levels, requests, crop_type):
+    from database import SessionLocal
+    from utils.reports import build_report
+    result = {"disease": "Benchmark", "solution": {"Preventive Measures": "n/a"}}
+
+    def insert():
+        db = SessionLocal()
+        try:
+            db.add(build_report(crop_type, result))
+            db.commit()
+        finally:
+            db.close()
+
+    return [{"concurrency": c, **run_threaded(insert, c, requests)} for c in concurrency_levels]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline, threshold):
+    """
+    Prints p95 and throughput changes against a previous run and returns the
+    regressions larger than `threshold` (a fraction, e.g. 0.1 for 10%).
+    """
+    regressions = []
+    for suite, rows in current["suites"].items():
+        baseline_rows = {(row.get("size"), row["concurrency"]): row for row in baseline["suites"].get(suite, [])}
+        for row in rows:
+            old = baseline_rows.get((row.get("size"), row["concurrency"]))
+            if old is None:
+                continue
+            p95_change = (row["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else 0.0
+            rps_change = ((row["requests_per_second"] - old["requests_per_second"]) / old["requests_per_second"]
+                          if old["requests_per_second"] else 0.0)
+            label = f"{suite} size={row.get('size', '-')} c={row['concurrency']}"
+            print(f"{label:<50} p95 {old['p95_ms']:>9.2f} -> {row['p95_ms']:>9.2f} ms ({p95_change:+.1%})  "
+                  f"rps {old['requests_per_second']:>8.1f} -> {row['requests_per_second']:>8.1f} ({rps_change:+.1%})")
+            if p95_change > threshold or rps_change < -threshold:
+                regressions.append(label)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the crop disease serving stack.")
+    parser.add_argument("--stub", action="store_true", help="use deterministic stub models instead of .keras files")
+    parser.add_argument("--crop", default="corn", help="crop type used for prediction benchmarks")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_IMAGE_SIZES, help="image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level")
+    parser.add_argument("--suites", nargs="+", default=["preprocess", "predict", "upload", "report_insert"])
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="regression threshold for --compare")
+    parser.add_argument("--database", help="database URL the upload and report_insert suites write to "
+                                           "(default: a fresh SQLite file; DATABASE_URL is ignored)")
+    args = parser.parse_args(argv)
+
+    # Benchmarks write throwaway reports (and rollups), so they never use the configured
+    # DATABASE_URL; this must happen before database/main are imported
+    database_url = args.database or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    if "database" in sys.modules and sys.modules["database"].DATABASE_URL != database_url:
+        parser.error("the database module is already imported; run the benchmark in a fresh process")
+    os.environ["DATABASE_URL"] = database_url
+
+    from utils.ml_integration import registry, class_names, prediction_cache
+    if args.stub:
+        install_stub_models(registry, class_names)
+    # Identical synthetic images would otherwise be served from the cache
+    prediction_cache.max_entries = 0
+    prediction_cache.persistent = False
+
+    images = {size: synthetic_jpeg(size, seed=i) for i, size in enumerate(args.sizes)}
+    suites = {}
+    if "preprocess" in args.suites:
+        suites["preprocess"] = bench_preprocess(images, args.concurrency, args.requests)
+    if "predict" in args.suites:
+        suites["predict"] = bench_predict(images, args.concurrency, args.requests, args.crop)
+    if "upload" in args.suites:
+        suites["upload"] = bench_upload_route(images, args.concurrency, args.requests, args.crop)
+    if "report_insert" in args.suites:
+        from database import Base, engine
+        Base.metadata.create_all(bind=engine)
+        suites["report_insert"] = bench_report_insert(args.concurrency, args.requests, args.crop)
+
+    results = {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "stub_models": args.stub,
+        "requests_per_level": args.requests,
+        "suites": suites,
+    }
+    for suite, rows in suites.items():
+        print(f"\n== {suite}")
+        for row in rows:
+            print(f"  size={row.get('size', '-'):<10} c={row['concurrency']:<3} p50={row['p50_ms']:>9.2f}ms "
+                  f"p95={row['p95_ms']:>9.2f}ms p99={row['p99_ms']:>9.2f}ms rps={row['requests_per_second']:>8.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\n== compared with {args.compare} (revision {baseline.get('revision')})")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
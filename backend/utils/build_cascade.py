@@ -0,0 +1,176 @@
+"""
+Builds the first-stage models of the confidence-gated cascade and calibrates
+their thresholds (see utils/cascade.py).
+
+Run from the backend directory:
+    python -m utils.build_cascade --train --crops corn grape --epochs 5
+    python -m utils.build_cascade --calibrate --target-accuracy 0.98
+
+--train distils each crop's full model into a small CNN that looks at the frame
+downscaled to --input-size (a Resizing layer in front, so it takes the same
+180x180 input) and learns the full model's probabilities on the training set.
+--calibrate scores the held-out images with both stages and writes, per crop,
+the lowest threshold whose cascade accuracy still reaches the target to
+CASCADE_THRESHOLDS_PATH. Serve with MODEL_CASCADE=true.
+"""
+import os
+import json
+import time
+import argparse
+import logging
+import numpy as np
+from utils.ml_integration import registry, fast_registry, class_names, dataset_dir
+from utils.dataset_pipeline import list_dataset, iter_batches, to_model_input
+from utils.dataset_shards import ShardDataset, DATASET_SHARD_DIR
+from utils.cascade import pick_threshold, probabilities, CASCADE_THRESHOLDS_PATH
+
+
+def split_samples(samples, holdout=0.1, seed=0):
+    """
+    Deterministic (train, held-out) split, so --calibrate never sees training images.
+    """
+    order = np.random.default_rng(seed).permutation(len(samples))
+    cut = int(round(len(samples) * holdout))
+    return [samples[i] for i in order[cut:]], [samples[i] for i in order[:cut]]
+
+
+def build_fast_model(num_classes, input_shape=(180, 180, 3), input_size=96, width=16):
+    import tensorflow as tf
+    layers = tf.keras.layers
+    return tf.keras.Sequential([
+        tf.keras.Input(shape=input_shape),
+        layers.Resizing(input_size, input_size),
+        layers.Conv2D(width, 3, strides=2, padding="same", activation="relu"),
+        layers.Conv2D(width * 2, 3, padding="same", activation="relu"),
+        layers.MaxPooling2D(),
+        layers.Conv2D(width * 4, 3, padding="same", activation="relu"),
+        layers.MaxPooling2D(),
+        layers.Conv2D(width * 8, 3, padding="same", activation="relu"),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(num_classes, activation="softmax"),
+    ], name="fast")
+
+
+def distill(crop_type, samples, epochs=5, batch_size=32, input_size=96, alpha=0.7, seed=0, shards=None):
+    """
+    Trains a fast model on a blend of the full model's probabilities (weight
+    `alpha`) and the true labels.
+    """
+    teacher = registry.get(crop_type)
+    # With FOLD_NORMALIZATION the served models scale uint8 input themselves
+    teacher_uint8 = registry.accepts_uint8(crop_type)
+    num_classes = len(class_names[crop_type])
+    student = build_fast_model(num_classes, input_size=input_size)
+    student.compile(optimizer="adam", loss="categorical_crossentropy", metrics=["accuracy"])
+
+    for epoch in range(epochs):
+        losses, accuracies = [], []
+        # Shards shuffle block-wise, so most of each batch is read sequentially
+        for images, labels, _ in iter_batches(samples, batch_size, shards=shards, shuffle=True, seed=seed + epoch):
+            inputs = to_model_input(images)
+            soft = np.apply_along_axis(probabilities, 1,
+                                       teacher.predict(to_model_input(images, teacher_uint8), verbose=0))
+            targets = alpha * soft + (1 - alpha) * np.eye(num_classes)[labels]
+            loss, accuracy = student.train_on_batch(inputs, targets)
+            losses.append(loss)
+            accuracies.append(accuracy)
+        logging.info(f"{crop_type} epoch {epoch + 1}/{epochs}: loss {np.mean(losses):.4f}, "
+                     f"accuracy {np.mean(accuracies):.4f}")
+    return student
+
+
+def calibrate_crop(crop_type, samples, target_accuracy, batch_size=32, shards=None):
+    """
+    Scores `samples` with both stages and picks the crop's threshold.
+    """
+    full, fast = registry.get(crop_type), fast_registry.get(crop_type)
+    full_uint8, fast_uint8 = registry.accepts_uint8(crop_type), fast_registry.accepts_uint8(crop_type)
+    confidences, fast_correct, full_correct = [], [], []
+    seconds = {"fast": 0.0, "full": 0.0}
+    for images, labels, _ in iter_batches(samples, batch_size, shards=shards):
+        started = time.perf_counter()
+        fast_probs = np.apply_along_axis(probabilities, 1,
+                                         fast.predict(to_model_input(images, fast_uint8), verbose=0))
+        seconds["fast"] += time.perf_counter() - started
+        started = time.perf_counter()
+        full_top1 = np.argmax(full.predict(to_model_input(images, full_uint8), verbose=0), axis=1)
+        seconds["full"] += time.perf_counter() - started
+        confidences.append(fast_probs.max(axis=1))
+        fast_correct.append(np.argmax(fast_probs, axis=1) == labels)
+        full_correct.append(full_top1 == labels)
+    if not confidences:
+        raise RuntimeError(f"No held-out images for '{crop_type}'")
+
+    confidences = np.concatenate(confidences)
+    fast_correct = np.concatenate(fast_correct)
+    full_correct = np.concatenate(full_correct)
+    threshold, accuracy, fast_share = pick_threshold(confidences, fast_correct, full_correct, target_accuracy)
+    images = len(confidences)
+    return {
+        "threshold": threshold,
+        "target_accuracy": target_accuracy,
+        "images": images,
+        "cascade_accuracy": round(accuracy, 4),
+        "fast_accuracy": round(float(fast_correct.mean()), 4),
+        "full_accuracy": round(float(full_correct.mean()), 4),
+        "fast_share": round(fast_share, 4),
+        "fast_images_per_second": round(images / seconds["fast"], 2) if seconds["fast"] else 0.0,
+        "full_images_per_second": round(images / seconds["full"], 2) if seconds["full"] else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and calibrate the cascade's first-stage models.")
+    parser.add_argument("--crops", nargs="*", default=registry.crop_types())
+    parser.add_argument("--dataset", default=dataset_dir)
+    parser.add_argument("--train", action="store_true", help="distil a fast model for each crop")
+    parser.add_argument("--calibrate", action="store_true", help="pick thresholds on the held-out images")
+    parser.add_argument("--target-accuracy", type=float, default=0.98)
+    parser.add_argument("--holdout", type=float, default=0.1, help="share of images kept out of training")
+    parser.add_argument("--limit", type=int, default=0, help="max images per class (0 = all)")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--input-size", type=int, default=96, help="side the fast model downscales to")
+    parser.add_argument("--shards", nargs="?", const=DATASET_SHARD_DIR,
+                        help="read compiled tensor shards (default dir: DATASET_SHARD_DIR)")
+    parser.add_argument("--output", default=CASCADE_THRESHOLDS_PATH, help="thresholds JSON file")
+    args = parser.parse_args(argv)
+    if not (args.train or args.calibrate):
+        parser.error("nothing to do: pass --train and/or --calibrate")
+
+    shards = ShardDataset(args.shards) if args.shards else None
+    samples = shards.list_samples(args.crops, args.limit) if shards else list_dataset(args.dataset, args.crops, args.limit)
+    thresholds = {}
+    if args.calibrate and os.path.exists(args.output):
+        # Crops not calibrated in this run keep their thresholds
+        with open(args.output) as f:
+            thresholds = json.load(f)
+
+    for crop_type in args.crops:
+        if crop_type not in samples:
+            logging.warning(f"No dataset images for '{crop_type}', skipping")
+            continue
+        train, holdout = split_samples(samples[crop_type], args.holdout)
+        if args.train:
+            model = distill(crop_type, train, args.epochs, args.batch_size, args.input_size, shards=shards)
+            path = fast_registry.manifest[crop_type]
+            model.save(path)
+            fast_registry.evict(crop_type)
+            print(f"{crop_type:<8} fast model saved to {path}")
+        if args.calibrate:
+            result = calibrate_crop(crop_type, holdout, args.target_accuracy, args.batch_size, shards)
+            thresholds[crop_type] = result
+            threshold = "disabled" if result["threshold"] is None else f"{result['threshold']:.4f}"
+            print(f"{crop_type:<8} threshold {threshold}  fast share {result['fast_share']:.2%}  "
+                  f"accuracy {result['full_accuracy']:.4f} (full) -> {result['cascade_accuracy']:.4f} (cascade)")
+
+    if args.calibrate:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(thresholds, f, indent=2)
+        print(f"\nThresholds written to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
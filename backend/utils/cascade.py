@@ -0,0 +1,135 @@
+"""
+Confidence-gated cascade: a small first-stage model answers when its top-1
+probability reaches the crop's threshold, and the full crop model runs only for
+the remaining images. Fast models live next to the full ones as
+<stem>.fast.keras; thresholds come from a JSON file written by
+    python -m utils.build_cascade --calibrate --target-accuracy 0.98
+"""
+import os
+import json
+import logging
+import threading
+from collections import Counter
+import numpy as np
+from utils.model_registry import MODEL_DIR
+
+# Off by default; with it on, a crop only cascades once it has a fast model and a threshold
+MODEL_CASCADE = os.getenv("MODEL_CASCADE", "false").lower() == "true"
+CASCADE_THRESHOLDS_PATH = os.getenv("CASCADE_THRESHOLDS_PATH", os.path.join(MODEL_DIR, "cascade_thresholds.json"))
+# Number of (label, probability) pairs returned with each prediction
+PREDICTION_TOP_K = int(os.getenv("PREDICTION_TOP_K", "3"))
+
+FAST_STAGE = "fast"
+FULL_STAGE = "full"
+
+
+def fast_model_path(model_path):
+    """
+    Where the first-stage model for the full model at `model_path` is stored.
+    """
+    return os.path.splitext(model_path)[0] + ".fast.keras"
+
+
+def probabilities(row):
+    """
+    Returns the row as probabilities, applying a softmax when a model emits logits.
+    """
+    row = np.asarray(row, dtype=np.float64)
+    if row.min() >= 0 and abs(row.sum() - 1.0) < 1e-3:
+        return row
+    exp = np.exp(row - row.max())
+    return exp / exp.sum()
+
+
+def top_k(labels, row, k=PREDICTION_TOP_K):
+    probs = probabilities(row)
+    order = np.argsort(probs)[::-1][:max(1, k)]
+    return [{"disease": labels[i], "probability": round(float(probs[i]), 4)} for i in order]
+
+
+def pick_threshold(confidences, fast_correct, full_correct, target_accuracy):
+    """
+    Lowest first-stage confidence threshold whose cascade accuracy (fast answer at or
+    above it, full answer below) still reaches `target_accuracy`, i.e. the one that
+    sends the most images to the fast model. Returns (threshold, accuracy, fast_share);
+    threshold is None when no threshold lets the fast model answer anything.
+    """
+    confidences = np.asarray(confidences, dtype=np.float64)
+    n = len(confidences)
+    if n == 0:
+        return None, 0.0, 0.0
+    order = np.argsort(-confidences, kind="stable")
+    confidences = confidences[order]
+    fast_hits = np.concatenate([[0], np.cumsum(np.asarray(fast_correct)[order])])
+    full_hits = np.concatenate([np.cumsum(np.asarray(full_correct)[order][::-1])[::-1], [0]])
+    # accuracy[i]: the i most confident images answered by the fast model
+    accuracy = (fast_hits + full_hits) / n
+
+    best = None
+    for i in range(1, n + 1):
+        # Only cut between distinct confidences, since a threshold cannot split ties
+        if i < n and confidences[i] == confidences[i - 1]:
+            continue
+        if accuracy[i] >= target_accuracy:
+            best = i
+    if best is None:
+        return None, float(accuracy[0]), 0.0
+    return float(confidences[best - 1]), float(accuracy[best]), best / n
+
+
+class CascadePolicy:
+    """
+    Per-crop thresholds and the counters of which stage answered. `fast_paths`
+    maps each crop to its first-stage model file.
+    """
+    def __init__(self, fast_paths, enabled=MODEL_CASCADE, thresholds_path=CASCADE_THRESHOLDS_PATH):
+        self.enabled = enabled
+        self.thresholds_path = thresholds_path
+        self.thresholds = {}
+        self._fast_paths = dict(fast_paths)
+        self._answers = Counter()
+        self._lock = threading.Lock()
+        if enabled:
+            self.load()
+
+    def load(self):
+        """
+        Reads {crop_type: threshold} (null disables a crop) from the thresholds file.
+        """
+        try:
+            with open(self.thresholds_path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            logging.warning(f"Cascade enabled but {self.thresholds_path} is missing; every crop uses the full model")
+            entries = {}
+        self.thresholds = {crop: entry["threshold"] if isinstance(entry, dict) else entry
+                           for crop, entry in entries.items()}
+
+    def enabled_for(self, crop_type):
+        if not self.enabled or self.thresholds.get(crop_type) is None:
+            return False
+        path = self._fast_paths.get(crop_type)
+        return path is not None and os.path.exists(path)
+
+    def accepts(self, crop_type, row):
+        return float(np.max(probabilities(row))) >= self.thresholds[crop_type]
+
+    def version(self, crop_type):
+        return f"t{self.thresholds[crop_type]:.4f}"
+
+    def record(self, crop_type, stage):
+        with self._lock:
+            self._answers[(crop_type, stage)] += 1
+
+    def stats(self):
+        with self._lock:
+            answers = dict(self._answers)
+        crops = {}
+        for (crop_type, stage), count in answers.items():
+            crops.setdefault(crop_type, {FAST_STAGE: 0, FULL_STAGE: 0})[stage] = count
+        return {
+            "enabled": self.enabled,
+            "thresholds": dict(self.thresholds),
+            "active": sorted(crop for crop in self.thresholds if self.enabled_for(crop)),
+            "answers": crops,
+        }
@@ -0,0 +1,160 @@
+"""
+Exports the crop .keras models to quantized TFLite / ONNX artifacts and checks
+their top-1 agreement with the original model.
+
+Run from the backend directory:
+    python -m utils.convert_models --crops corn --formats tflite onnx --variants float16 int8
+
+Artifacts are written next to each .keras file as <stem>.<variant>.<ext>, which
+is where MODEL_BACKEND / MODEL_BACKEND_<CROP> (e.g. "tflite:int8") look for them.
+ONNX export needs tf2onnx, onnxruntime and (for float16) onnxconverter-common.
+"""
+import os
+import json
+import time
+import argparse
+import logging
+import numpy as np
+from utils.ml_integration import registry, dataset_dir
+from utils.dataset_pipeline import list_dataset, iter_batches, to_model_input
+from utils.inference_backends import artifact_path, load_model_artifact, QUANTIZATION_VARIANTS
+
+
+def sample_images(crop_type, count, root=dataset_dir, seed=0):
+    """
+    Returns up to `count` preprocessed float32 images (and labels) drawn at
+    random from the crop's dataset folders.
+    """
+    samples = list_dataset(root, [crop_type]).get(crop_type, [])
+    rng = np.random.default_rng(seed)
+    picked = [samples[i] for i in rng.permutation(len(samples))[:count]]
+    images, labels = [], []
+    for batch, batch_labels, _ in iter_batches(picked, batch_size=64):
+        images.append(to_model_input(batch))
+        labels.append(batch_labels)
+    if not images:
+        raise RuntimeError(f"No dataset images found for '{crop_type}' under {root}")
+    return np.concatenate(images), np.concatenate(labels)
+
+
+def export_tflite(model, output_path, variant, calibration_images):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        def representative_dataset():
+            for image in calibration_images:
+                yield [image[np.newaxis].astype(np.float32)]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, output_path, variant, calibration_images):
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise RuntimeError("ONNX export requires tf2onnx (pip install tf2onnx onnxruntime)")
+
+    input_signature = [tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="input")]
+    float_path = output_path + ".float32.tmp"
+    tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=13, output_path=float_path)
+
+    try:
+        if variant == "float16":
+            import onnx
+            from onnxconverter_common import float16
+            onnx.save(float16.convert_float_to_float16(onnx.load(float_path), keep_io_types=True), output_path)
+        else:
+            from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantFormat, QuantType
+
+            class Reader(CalibrationDataReader):
+                def __init__(self):
+                    self._images = iter(calibration_images)
+
+                def get_next(self):
+                    image = next(self._images, None)
+                    return None if image is None else {"input": image[np.newaxis].astype(np.float32)}
+
+            quantize_static(float_path, output_path, Reader(), quant_format=QuantFormat.QDQ,
+                            activation_type=QuantType.QInt8, weight_type=QuantType.QInt8, per_channel=True)
+    finally:
+        if os.path.exists(float_path):
+            os.remove(float_path)
+
+
+EXPORTERS = {"tflite": export_tflite, "onnx": export_onnx}
+
+
+def parity_check(reference, candidate, images, labels, batch_size=32):
+    """
+    Top-1 agreement between two models on `images`, plus each one's accuracy and
+    the candidate's inference throughput.
+    """
+    reference_top1, candidate_top1 = [], []
+    candidate_seconds = 0.0
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        reference_top1.append(np.argmax(reference.predict(batch, verbose=0), axis=1))
+        started = time.perf_counter()
+        candidate_top1.append(np.argmax(candidate.predict(batch, verbose=0), axis=1))
+        candidate_seconds += time.perf_counter() - started
+    reference_top1 = np.concatenate(reference_top1)
+    candidate_top1 = np.concatenate(candidate_top1)
+    return {
+        "images": int(len(images)),
+        "top1_agreement": float(np.mean(reference_top1 == candidate_top1)),
+        "reference_accuracy": float(np.mean(reference_top1 == labels)),
+        "candidate_accuracy": float(np.mean(candidate_top1 == labels)),
+        "candidate_images_per_second": round(len(images) / candidate_seconds, 2) if candidate_seconds else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export quantized TFLite/ONNX artifacts for the crop models.")
+    parser.add_argument("--crops", nargs="*", default=registry.crop_types())
+    parser.add_argument("--formats", nargs="+", choices=sorted(EXPORTERS), default=["tflite"])
+    parser.add_argument("--variants", nargs="+", choices=QUANTIZATION_VARIANTS, default=list(QUANTIZATION_VARIANTS))
+    parser.add_argument("--dataset", default=dataset_dir)
+    parser.add_argument("--calibration-samples", type=int, default=200)
+    parser.add_argument("--parity-samples", type=int, default=500)
+    parser.add_argument("--skip-export", action="store_true", help="only run the parity check on existing artifacts")
+    parser.add_argument("--output", help="write the parity report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    from tensorflow.keras.models import load_model
+
+    report = {}
+    for crop_type in args.crops:
+        keras_path = registry.manifest[crop_type]
+        model = load_model(keras_path)
+        calibration_images, _ = sample_images(crop_type, args.calibration_samples, args.dataset, seed=0)
+        parity_images, parity_labels = sample_images(crop_type, args.parity_samples, args.dataset, seed=1)
+
+        for backend in args.formats:
+            for variant in args.variants:
+                spec = f"{backend}:{variant}"
+                output_path = artifact_path(keras_path, spec)
+                if not args.skip_export:
+                    logging.info(f"Exporting {crop_type} -> {output_path}")
+                    EXPORTERS[backend](model, output_path, variant, calibration_images)
+                result = parity_check(model, load_model_artifact(output_path), parity_images, parity_labels)
+                result["path"] = output_path
+                report.setdefault(crop_type, {})[spec] = result
+                print(f"{crop_type:<8} {spec:<15} top-1 agreement {result['top1_agreement']:.4f}  "
+                      f"accuracy {result['reference_accuracy']:.4f} -> {result['candidate_accuracy']:.4f}  "
+                      f"{result['candidate_images_per_second']} images/sec")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,95 @@
+import os
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from utils.ml_integration import dataset_dir, dataset_class_map, class_names, load_rgb_image
+
+
+def list_dataset(root=dataset_dir, crop_types=None, limit_per_class=0):
+    """
+    Returns {crop_type: [(image_path, label_index), ...]} for every folder in `root`
+    that dataset_class_map knows about. Unmapped folders (crops without a model)
+    are skipped.
+    """
+    samples = {}
+    for folder in sorted(os.listdir(root)):
+        if folder not in dataset_class_map:
+            logging.debug(f"Skipping unmapped dataset folder '{folder}'")
+            continue
+        crop_type, label = dataset_class_map[folder]
+        if crop_types and crop_type not in crop_types:
+            continue
+        label_index = class_names[crop_type].index(label)
+        folder_path = os.path.join(root, folder)
+        files = sorted(name for name in os.listdir(folder_path)
+                       if os.path.splitext(name)[1].lower() in (".jpg", ".jpeg", ".png"))
+        if limit_per_class:
+            files = files[:limit_per_class]
+        samples.setdefault(crop_type, []).extend((os.path.join(folder_path, name), label_index) for name in files)
+    return samples
+
+
+def _load(path, target_size):
+    try:
+        return load_rgb_image(path, target_size)
+    except Exception as e:
+        logging.warning(f"Skipping unreadable image {path}: {e}")
+        return None
+
+
+def iter_batches(samples, batch_size=32, workers=None, prefetch=4, target_size=(180, 180), shards=None,
+                 shuffle=False, seed=0):
+    """
+    Decodes and resizes `samples` ([(path, label), ...]) on a thread pool and yields
+    (images, labels, paths) batches, with images as (n, H, W, 3) uint8. At most
+    `prefetch` batches are decoded ahead of the consumer, so memory stays bounded.
+    With `shards` (a dataset_shards.ShardDataset) the frames are read from the
+    compiled shards instead of being decoded. `shuffle` reorders the samples with
+    `seed` (for shards, block-wise; see ShardDataset.batches).
+    """
+    if shards is not None:
+        if tuple(target_size) != shards.image_size:
+            raise ValueError(f"Shards hold {shards.image_size} images, {tuple(target_size)} requested")
+        yield from shards.batches(samples, batch_size, shuffle=shuffle, seed=seed)
+        return
+    if shuffle:
+        samples = [samples[i] for i in np.random.default_rng(seed).permutation(len(samples))]
+
+    workers = workers or os.cpu_count() or 4
+    chunks = (samples[i:i + batch_size] for i in range(0, len(samples), batch_size))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as pool:
+        pending = deque()
+
+        def submit_next():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append((chunk, [pool.submit(_load, path, target_size) for path, _ in chunk]))
+
+        for _ in range(max(1, prefetch)):
+            submit_next()
+
+        while pending:
+            chunk, futures = pending.popleft()
+            submit_next()
+            images, labels, paths = [], [], []
+            for (path, label), future in zip(chunk, futures):
+                img = future.result()
+                if img is not None:
+                    images.append(img)
+                    labels.append(label)
+                    paths.append(path)
+            if images:
+                yield np.stack(images), np.array(labels), paths
+
+
+def to_model_input(images, uint8_input=False):
+    """
+    Scales a uint8 image batch to the float [0, 1] range the models were trained on.
+    With `uint8_input` (a model whose normalization was folded into the graph, see
+    ModelRegistry.accepts_uint8) the batch is passed through unscaled.
+    """
+    if uint8_input:
+        return images
+    return images.astype(np.float32) / 255.0
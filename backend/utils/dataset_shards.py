@@ -0,0 +1,309 @@
+"""
+Compiles the training dataset into memory-mapped uint8 tensor shards, so
+evaluation and training runs read preprocessed 180x180 frames instead of
+decoding and resizing every JPEG again.
+
+Run from the backend directory:
+    python -m utils.dataset_shards --compile [--dataset DIR] [--output DIR]
+
+Each class folder becomes <output>/<folder>/images-<generation>.npy, an
+(n, 180, 180, 3) uint8 array in RGB, with index.json holding the crop type,
+label and, per row, the source file name, size and mtime. Recompiling only
+decodes files that are new or whose size or mtime changed; unchanged rows are
+copied from the previous shard. Use the shards with the --shards option of
+utils.evaluate_models and utils.build_cascade, or via ShardDataset.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from utils.ml_integration import dataset_dir, dataset_class_map, class_names, load_rgb_image
+
+DATASET_SHARD_DIR = os.getenv("DATASET_SHARD_DIR", os.path.join(os.path.dirname(dataset_dir), "shards"))
+SHARD_IMAGE_SIZE = (180, 180)
+# Blocks of consecutive rows mixed together when shuffled batches are read
+SHARD_SHUFFLE_BLOCKS = int(os.getenv("SHARD_SHUFFLE_BLOCKS", "4"))
+INDEX_FILE = "index.json"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def _source_files(folder_path):
+    """
+    [{"name", "size", "mtime_ns"}] for the images in a class folder, sorted by name.
+    """
+    files = []
+    for entry in sorted(os.scandir(folder_path), key=lambda e: e.name):
+        if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+            stat = entry.stat()
+            files.append({"name": entry.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+    return files
+
+
+def _load_index(class_dir):
+    try:
+        with open(os.path.join(class_dir, INDEX_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _is_shard_dir(class_dir):
+    """
+    True when `class_dir` holds an index.json written by compile_class.
+    """
+    try:
+        index = _load_index(class_dir)
+    except (OSError, ValueError):
+        return False
+    return isinstance(index, dict) and {"images_file", "entries", "image_size"} <= index.keys()
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _decode_into(out, row, path, target_size):
+    try:
+        out[row] = load_rgb_image(path, target_size)
+        return True
+    except Exception as e:
+        logging.warning(f"Skipping unreadable image {path}: {e}")
+        return False
+
+
+def _remove_class_dir(class_dir):
+    """
+    Deletes the files compile_class wrote, and the directory once nothing else is in it.
+    """
+    for name in os.listdir(class_dir):
+        if name in (INDEX_FILE, f"{INDEX_FILE}.tmp") or (name.startswith("images-") and name.endswith(".npy")):
+            os.remove(os.path.join(class_dir, name))
+    try:
+        os.rmdir(class_dir)
+    except OSError:
+        logging.warning(f"Left {class_dir} in place: it holds files that are not shards")
+
+
+def compile_class(folder_path, class_dir, crop_type, label, pool, target_size=SHARD_IMAGE_SIZE):
+    """
+    Brings one class folder's shard up to date. Returns {"decoded", "reused", "stale"},
+    stale being rows of the previous shard whose file changed or disappeared.
+    """
+    files = _source_files(folder_path)
+    old = _load_index(class_dir)
+    if not files:
+        if os.path.isdir(class_dir) and _is_shard_dir(class_dir):
+            _remove_class_dir(class_dir)
+        return {"decoded": 0, "reused": 0, "stale": len(old["entries"]) if old else 0}
+    old_rows = {}
+    if old is not None and old["image_size"] == list(target_size):
+        old_rows = {(e["name"], e["size"], e["mtime_ns"]): e for e in old["entries"]}
+        if [(e["name"], e["size"], e["mtime_ns"]) for e in old["entries"]] == \
+                [(f["name"], f["size"], f["mtime_ns"]) for f in files]:
+            return {"decoded": 0, "reused": len(files), "stale": 0}
+
+    os.makedirs(class_dir, exist_ok=True)
+    images_file = f"images-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}.npy"
+    images = np.lib.format.open_memmap(os.path.join(class_dir, images_file), mode="w+", dtype=np.uint8,
+                                       shape=(len(files), *target_size, 3))
+    previous = np.load(os.path.join(class_dir, old["images_file"]), mmap_mode="r") if old_rows else None
+
+    entries, pending, reused = [], [], 0
+    for row, source in enumerate(files):
+        entry = dict(source, row=row, ok=True)
+        old_entry = old_rows.get((source["name"], source["size"], source["mtime_ns"]))
+        if old_entry is not None:
+            entry["ok"] = old_entry["ok"]
+            if old_entry["ok"]:
+                images[row] = previous[old_entry["row"]]
+            reused += 1
+        else:
+            pending.append((row, pool.submit(_decode_into, images, row,
+                                             os.path.join(folder_path, source["name"]), target_size)))
+        entries.append(entry)
+    for row, future in pending:
+        entries[row]["ok"] = future.result()
+    images.flush()
+    del images, previous
+
+    # index.json is the commit point: readers see either the old or the new shard
+    _write_json_atomic(os.path.join(class_dir, INDEX_FILE), {
+        "folder": os.path.basename(folder_path),
+        "crop_type": crop_type,
+        "label": label,
+        "label_index": class_names[crop_type].index(label),
+        "image_size": list(target_size),
+        "images_file": images_file,
+        "entries": entries,
+    })
+    for name in os.listdir(class_dir):
+        if name.endswith(".npy") and name != images_file:
+            os.remove(os.path.join(class_dir, name))
+    stale = len(old["entries"]) - reused if old is not None else 0
+    return {"decoded": len(pending), "reused": reused, "stale": stale}
+
+
+def compile_dataset(root=dataset_dir, output=DATASET_SHARD_DIR, workers=None):
+    """
+    Compiles every class folder dataset_class_map knows about, and drops shards
+    whose folder no longer exists. Returns {folder: counts}.
+    """
+    folders = [folder for folder in sorted(os.listdir(root)) if folder in dataset_class_map]
+    report = {}
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4, thread_name_prefix="decode") as pool:
+        for folder in folders:
+            started = time.perf_counter()
+            crop_type, label = dataset_class_map[folder]
+            counts = compile_class(os.path.join(root, folder), os.path.join(output, folder), crop_type, label, pool)
+            counts["seconds"] = round(time.perf_counter() - started, 2)
+            report[folder] = counts
+            logging.info(f"{folder}: {counts}")
+
+    if os.path.isdir(output):
+        for folder in os.listdir(output):
+            class_dir = os.path.join(output, folder)
+            # Only shards this tool wrote are removed, whatever else --output contains
+            if folder not in report and os.path.isdir(class_dir) and _is_shard_dir(class_dir):
+                _remove_class_dir(class_dir)
+                logging.info(f"Removed shard files for deleted folder '{folder}'")
+    return report
+
+
+class ShardDataset:
+    """
+    Read-only view of the compiled shards. Arrays are memory-mapped, so opening it
+    is cheap and pages are read on first touch.
+    """
+    def __init__(self, root=DATASET_SHARD_DIR):
+        self.root = root
+        self.classes = []
+        self._images = []
+        # (folder, file name) -> (class position, row), or None for an unreadable source
+        self._locations = {}
+        for folder in sorted(os.listdir(root)):
+            index = _load_index(os.path.join(root, folder)) if os.path.isdir(os.path.join(root, folder)) else None
+            if index is None:
+                continue
+            position = len(self.classes)
+            self.classes.append(index)
+            self._images.append(np.load(os.path.join(root, folder, index["images_file"]), mmap_mode="r"))
+            for entry in index["entries"]:
+                self._locations[(folder, entry["name"])] = (position, entry["row"]) if entry["ok"] else None
+        if not self.classes:
+            raise RuntimeError(f"No compiled shards under {root}; run python -m utils.dataset_shards --compile")
+        self.image_size = tuple(self.classes[0]["image_size"])
+
+    def list_samples(self, crop_types=None, limit_per_class=0):
+        """
+        Same shape as dataset_pipeline.list_dataset: {crop_type: [(path, label_index), ...]},
+        with paths as <dataset root>/<folder>/<file> for the loader to look up.
+        """
+        samples = {}
+        for index in self.classes:
+            if crop_types and index["crop_type"] not in crop_types:
+                continue
+            names = [entry["name"] for entry in index["entries"] if entry["ok"]]
+            if limit_per_class:
+                names = names[:limit_per_class]
+            samples.setdefault(index["crop_type"], []).extend(
+                (os.path.join(self.root, index["folder"], name), index["label_index"]) for name in names)
+        return samples
+
+    def locate(self, path):
+        """
+        (class position, row) of a source image; None when it could not be decoded.
+        """
+        key = (os.path.basename(os.path.dirname(path)), os.path.basename(path))
+        try:
+            return self._locations[key]
+        except KeyError:
+            raise KeyError(f"{path} is not in the compiled shards; recompile them") from None
+
+    def batches(self, samples, batch_size=32, shuffle=False, seed=0, buffer_blocks=SHARD_SHUFFLE_BLOCKS):
+        """
+        Yields (images, labels, paths) like dataset_pipeline.iter_batches. A batch of
+        consecutive rows from one shard is a zero-copy view of the memory map; any
+        other batch is gathered with one copy per image, never a decode. Unreadable
+        sources are skipped, as iter_batches does.
+
+        Without `shuffle` the batches follow the order of `samples`. With it, the
+        samples are cut into batch-sized blocks of consecutive rows per shard, the
+        blocks are shuffled, and samples are shuffled within each window of
+        `buffer_blocks` blocks: reads stay sequential within a block, but a batch
+        mixing blocks is gathered. buffer_blocks=1 keeps every full batch a
+        zero-copy view, at the cost of fixed batch contents across epochs.
+        """
+        if shuffle:
+            yield from self._shuffled_batches(samples, batch_size, np.random.default_rng(seed),
+                                              max(1, int(buffer_blocks)))
+            return
+        for start in range(0, len(samples), batch_size):
+            yield from self._batch(samples[start:start + batch_size])
+
+    def _shuffled_batches(self, samples, batch_size, rng, buffer_blocks):
+        by_shard = {}
+        for sample in samples:
+            location = self.locate(sample[0])
+            if location is not None:
+                by_shard.setdefault(location[0], []).append((location[1], sample))
+        blocks = []
+        for rows in by_shard.values():
+            rows = [sample for _, sample in sorted(rows, key=lambda row: row[0])]
+            blocks.extend(rows[i:i + batch_size] for i in range(0, len(rows), batch_size))
+        order = rng.permutation(len(blocks))
+        for start in range(0, len(order), buffer_blocks):
+            window = [sample for i in order[start:start + buffer_blocks] for sample in blocks[i]]
+            if buffer_blocks > 1:
+                window = [window[i] for i in rng.permutation(len(window))]
+            for i in range(0, len(window), batch_size):
+                yield from self._batch(window[i:i + batch_size])
+
+    def _batch(self, chunk):
+        located = [(sample, self.locate(sample[0])) for sample in chunk]
+        located = [(sample, location) for sample, location in located if location is not None]
+        if not located:
+            return
+        chunk = [sample for sample, _ in located]
+        locations = [location for _, location in located]
+        position, first_row = locations[0]
+        if all(loc == (position, first_row + i) for i, loc in enumerate(locations)):
+            images = self._images[position][first_row:first_row + len(chunk)]
+        else:
+            images = np.empty((len(chunk), *self.image_size, 3), dtype=np.uint8)
+            for i, (position, row) in enumerate(locations):
+                images[i] = self._images[position][row]
+        yield images, np.array([label for _, label in chunk]), [path for path, _ in chunk]
+
+    def stats(self):
+        return {
+            "root": self.root,
+            "classes": len(self.classes),
+            "images": sum(location is not None for location in self._locations.values()),
+            "bytes": int(sum(images.nbytes for images in self._images)),
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compile the dataset into memory-mapped tensor shards.")
+    parser.add_argument("--compile", action="store_true", help="create or update the shards")
+    parser.add_argument("--dataset", default=dataset_dir, help="dataset root with one folder per class")
+    parser.add_argument("--output", default=DATASET_SHARD_DIR, help="shard directory")
+    parser.add_argument("--workers", type=int, default=None, help="decode threads (default: CPU count)")
+    args = parser.parse_args()
+
+    if args.compile:
+        started = time.perf_counter()
+        report = compile_dataset(args.dataset, args.output, args.workers)
+        totals = {key: sum(counts[key] for counts in report.values()) for key in ("decoded", "reused", "stale")}
+        print(f"{len(report)} classes in {time.perf_counter() - started:.1f}s: {totals}")
+        print(ShardDataset(args.output).stats())
+    else:
+        parser.print_help()
@@ -0,0 +1,100 @@
+"""
+Offline scoring of the crop models against the labelled dataset.
+
+Run from the backend directory:
+    python -m utils.evaluate_models --crops corn grape --batch-size 64 --output eval.json
+
+With --shards the images come from the compiled tensor shards (see
+utils/dataset_shards.py) instead of being decoded from the JPEG folders.
+"""
+import json
+import time
+import argparse
+import numpy as np
+from utils.ml_integration import registry, class_names, dataset_dir
+from utils.dataset_pipeline import list_dataset, iter_batches, to_model_input
+from utils.dataset_shards import ShardDataset, DATASET_SHARD_DIR
+
+
+def evaluate_crop(crop_type, samples, batch_size=32, workers=None, prefetch=4, shards=None):
+    """
+    Runs every sample through the crop's model and returns accuracy, per-class
+    accuracy, the confusion matrix (rows: true label, columns: predicted) and throughput.
+    """
+    labels = class_names[crop_type]
+    model = registry.get(crop_type)
+    # With FOLD_NORMALIZATION the served model scales uint8 input itself
+    uint8_input = registry.accepts_uint8(crop_type)
+    confusion = np.zeros((len(labels), len(labels)), dtype=np.int64)
+
+    started = time.perf_counter()
+    inference_seconds = 0.0
+    for images, true_labels, _ in iter_batches(samples, batch_size, workers, prefetch, shards=shards):
+        inference_started = time.perf_counter()
+        predictions = model.predict(to_model_input(images, uint8_input), verbose=0)
+        inference_seconds += time.perf_counter() - inference_started
+        np.add.at(confusion, (true_labels, np.argmax(predictions, axis=1)), 1)
+    elapsed = time.perf_counter() - started
+
+    scored = int(confusion.sum())
+    support = confusion.sum(axis=1)
+    return {
+        "crop_type": crop_type,
+        "images": scored,
+        "accuracy": float(np.trace(confusion) / scored) if scored else 0.0,
+        "per_class": {
+            label: {
+                "support": int(support[i]),
+                "accuracy": float(confusion[i, i] / support[i]) if support[i] else None,
+            }
+            for i, label in enumerate(labels)
+        },
+        "labels": labels,
+        "confusion_matrix": confusion.tolist(),
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(scored / elapsed, 2) if elapsed else 0.0,
+        "inference_images_per_second": round(scored / inference_seconds, 2) if inference_seconds else 0.0,
+    }
+
+
+def print_report(report):
+    print(f"\n== {report['crop_type']}: {report['images']} images, "
+          f"accuracy {report['accuracy']:.4f}, {report['images_per_second']} images/sec "
+          f"({report['inference_images_per_second']} images/sec in model.predict)")
+    for label, stats in report["per_class"].items():
+        accuracy = "n/a" if stats["accuracy"] is None else f"{stats['accuracy']:.4f}"
+        print(f"  {label:<50} {accuracy:>8}  (n={stats['support']})")
+    print("  confusion matrix (rows: true, columns: predicted):")
+    for label, row in zip(report["labels"], report["confusion_matrix"]):
+        print(f"  {label[:30]:<30} " + " ".join(f"{count:>6}" for count in row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the crop models on the labelled dataset.")
+    parser.add_argument("--dataset", default=dataset_dir, help="dataset root with one folder per class")
+    parser.add_argument("--crops", nargs="*", help="crop types to evaluate (default: all with data)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None, help="decode threads (default: CPU count)")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches decoded ahead of inference")
+    parser.add_argument("--limit", type=int, default=0, help="max images per class (0 = all)")
+    parser.add_argument("--shards", nargs="?", const=DATASET_SHARD_DIR,
+                        help="read compiled tensor shards (default dir: DATASET_SHARD_DIR)")
+    parser.add_argument("--output", help="write the full results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    shards = ShardDataset(args.shards) if args.shards else None
+    samples = shards.list_samples(args.crops, args.limit) if shards else list_dataset(args.dataset, args.crops, args.limit)
+    reports = []
+    for crop_type, crop_samples in samples.items():
+        report = evaluate_crop(crop_type, crop_samples, args.batch_size, args.workers, args.prefetch, shards)
+        print_report(report)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"dataset": args.dataset, "results": reports}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
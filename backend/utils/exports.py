@@ -0,0 +1,141 @@
+import io
+import csv
+import json
+import zlib
+from dataclasses import dataclass
+from datetime import date, datetime
+from fastapi import Query
+from fastapi.responses import StreamingResponse
+from database import SessionLocal
+from models import User
+from utils.report_queries import REPORT_COLUMNS, filter_reports
+
+# Rows fetched per round trip from the server-side cursor; also the rows per emitted chunk
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Password hashes are never exported
+USER_COLUMNS = {
+    "id": User.id,
+    "email": User.email,
+    "username": User.username,
+    "is_admin": User.is_admin,
+    "registered_on": User.registered_on,
+}
+
+
+def _user_query(db, columns, start=None, end=None, is_admin=None):
+    query = db.query(*(USER_COLUMNS[name].label(name) for name in columns))
+    if start:
+        query = query.filter(User.registered_on >= start)
+    if end:
+        query = query.filter(User.registered_on < end)
+    if is_admin is not None:
+        query = query.filter(User.is_admin == is_admin)
+    return query.order_by(User.id)
+
+
+def _report_query(db, columns, **filters):
+    query = db.query(*(REPORT_COLUMNS[name].label(name) for name in columns))
+    return filter_reports(query, **filters).order_by(REPORT_COLUMNS["id"])
+
+
+EXPORTS = {"users": (USER_COLUMNS, _user_query), "reports": (REPORT_COLUMNS, _report_query)}
+
+
+def iter_rows(kind, filters, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields (columns, chunk of row tuples) for an export. The session is owned by
+    the generator and rows come through yield_per, so only one chunk is ever in memory.
+    """
+    columns, build_query = EXPORTS[kind]
+    names = list(columns)
+    db = SessionLocal()
+    try:
+        chunk = []
+        for row in build_query(db, names, **filters).yield_per(chunk_size):
+            chunk.append(tuple(row))
+            if len(chunk) >= chunk_size:
+                yield names, chunk
+                chunk = []
+        if chunk:
+            yield names, chunk
+    finally:
+        db.close()
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def format_csv(chunks):
+    header_written = False
+    for names, rows in chunks:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not header_written:
+            writer.writerow(names)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+
+
+def format_ndjson(chunks):
+    for names, rows in chunks:
+        yield "".join(json.dumps({name: _json_value(value) for name, value in zip(names, row)}) + "\n"
+                      for row in rows).encode()
+
+
+FORMATTERS = {"csv": format_csv, "ndjson": format_ndjson}
+
+
+def gzip_stream(chunks):
+    """
+    Gzips a byte stream incrementally, flushing after each chunk so the client
+    receives data as it is produced.
+    """
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip container
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_response(kind, export_format="csv", compress=False, **filters):
+    """
+    StreamingResponse for a users/reports export in CSV or NDJSON, optionally
+    as a .gz download.
+    """
+    body = FORMATTERS[export_format](iter_rows(kind, filters))
+    filename = f"{kind}.{export_format}"
+    media_type = EXPORT_FORMATS[export_format]
+    if compress:
+        body = gzip_stream(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@dataclass(frozen=True)
+class ExportRequest:
+    kind: str
+    export_format: str
+    compress: bool
+    filters: dict
+
+    def response(self):
+        return export_response(self.kind, self.export_format, self.compress, **self.filters)
+
+
+# Query parameters of the export endpoints, shared by main.py and routes/admin_routes.py
+# as dependencies so both apps accept the same filters
+def user_export_request(format: str = Query("csv", pattern="^(csv|ndjson)$"), gzip: bool = False,
+                        start: datetime = None, end: datetime = None, is_admin: bool = None):
+    return ExportRequest("users", format, gzip, {"start": start, "end": end, "is_admin": is_admin})
+
+
+def report_export_request(format: str = Query("csv", pattern="^(csv|ndjson)$"), gzip: bool = False,
+                          user_id: int = None, crop_type: str = None, disease: str = None,
+                          start: datetime = None, end: datetime = None):
+    return ExportRequest("reports", format, gzip, {"user_id": user_id, "crop_type": crop_type, "disease": disease,
+                                                   "start": start, "end": end})
@@ -2,49 +2,47 @@ from fastapi import UploadFile, HTTPException
 from PIL import Image, UnidentifiedImageError
 import os
 from io import BytesIO
+from utils.image_store import image_store
+from utils.ingest import ingest_file, UploadRejectedError
 
-UPLOAD_DIR = "uploads/"  # Directory to save uploaded images
-
-# Ensure the directory exists
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
-
-def save_file_to_disk(uploaded_file: UploadFile, destination: str = UPLOAD_DIR) -> str:
+def read_image(uploaded_file: UploadFile):
     """
-    Saves the uploaded file to the specified destination and returns the file path.
-    Validates file format and size before saving.
+    Reads and validates the upload in one pass (size cap, magic bytes, header
+    dimensions) and returns the IngestedImage.
     """
-    # Check if file type is allowed before processing
-    if not allowed_file(uploaded_file.filename):
-        raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
+    try:
+        return ingest_file(uploaded_file.file)
+    except UploadRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-    # Create file path
-    file_location = os.path.join(destination, uploaded_file.filename)
+def save_file_to_disk(uploaded_file: UploadFile) -> str:
+    """
+    Saves the uploaded file to the content-addressed image store and returns its path.
+    Files are keyed by content hash, so identical uploads are stored once and
+    client-supplied names can never collide.
+    """
+    # The content is checked, not the client-supplied file name
+    image = read_image(uploaded_file)
 
-    # Save file to disk
+    # Save file to the store
     try:
-        with open(file_location, "wb+") as file_object:
-            file_object.write(uploaded_file.file.read())
+        digest = image_store.put(image.data, image.digest)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving file: {e}")
 
-    return file_location
+    return image_store.path_for(digest)
 
 def convert_to_image(uploaded_file: UploadFile) -> Image.Image:
     """
     Converts an uploaded file into a PIL Image object.
     """
-    if not allowed_file(uploaded_file.filename):
-        raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
-    
-    try:
-        contents = uploaded_file.file.read()
-        image = Image.open(BytesIO(contents))
+    upload = read_image(uploaded_file)
 
-        # This will confirm if the file content is really an image
-        image.verify()
-        # Re-open to actually work with it after verification
-        image = Image.open(BytesIO(contents))
+    try:
+        # The header was validated while reading, so decode once; load() surfaces
+        # truncated or corrupt pixel data here rather than at first use
+        image = Image.open(BytesIO(upload.data))
+        image.load()
         return image
     except UnidentifiedImageError:
         raise HTTPException(status_code=400, detail="Uploaded file is not a valid image.")
@@ -0,0 +1,62 @@
+import struct
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...) carry the dimensions
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length field
+_JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xDA)}
+
+
+def sniff_format(header):
+    """
+    Returns "jpeg", "png" or None from the leading magic bytes.
+    """
+    header = bytes(header[:8])
+    if header.startswith(JPEG_MAGIC):
+        return "jpeg"
+    if header.startswith(PNG_MAGIC):
+        return "png"
+    return None
+
+
+def image_dimensions(data):
+    """
+    Reads (width, height) from a JPEG or PNG header without decoding the image.
+    Returns None when the format is unknown or `data` ends before the dimensions
+    (so it can be called again once more bytes have arrived).
+    """
+    image_format = sniff_format(data)
+    if image_format == "png":
+        # IHDR is always the first chunk: width and height follow its type at offset 16
+        if len(data) < 24 or bytes(data[12:16]) != b"IHDR":
+            return None
+        return struct.unpack(">II", bytes(data[16:24]))
+    if image_format == "jpeg":
+        return _jpeg_dimensions(data)
+    return None
+
+
+def _jpeg_dimensions(data):
+    i = 2
+    length = len(data)
+    while i + 4 <= length:
+        if data[i] != 0xFF:
+            raise ValueError("Corrupt JPEG header")
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            i += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if i + 9 > length:
+                return None
+            height, width = struct.unpack(">HH", bytes(data[i + 5:i + 9]))
+            return width, height
+        if marker == 0xDA:  # start of scan without a frame header
+            raise ValueError("JPEG has no frame header")
+        i += 2 + struct.unpack(">H", bytes(data[i + 2:i + 4]))[0]
+    return None
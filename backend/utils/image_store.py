@@ -0,0 +1,205 @@
+"""
+Content-addressed storage for uploaded images. Each image is stored once under
+its sha256 digest, sharded as <root>/ab/cd/<digest>, with a JPEG thumbnail
+next to it as <digest>.thumb.jpg.
+
+Images no longer referenced by any report are removed by the garbage
+collector. Run it from the backend directory:
+    python -m utils.image_store --gc [--dry-run] [--min-age 3600]
+"""
+import os
+import re
+import time
+import logging
+import argparse
+import tempfile
+import cv2 as cv
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from utils.image_headers import sniff_format
+from utils.prediction_cache import image_digest
+
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "image_store")
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+# Files younger than this are never collected, so an upload whose report is
+# still being written (e.g. queued by the write-behind writer) keeps its image
+IMAGE_GC_MIN_AGE_S = float(os.getenv("IMAGE_GC_MIN_AGE_S", "3600"))
+
+CHUNK_SIZE = 64 * 1024
+CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png"}
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ImageStore:
+    def __init__(self, root=IMAGE_STORE_DIR, thumbnail_size=THUMBNAIL_SIZE):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+
+    def path_for(self, digest, thumbnail=False):
+        if not _DIGEST_RE.match(digest):
+            raise ValueError("Invalid image digest")
+        name = f"{digest}.thumb.jpg" if thumbnail else digest
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def put(self, data, digest=None):
+        """
+        Stores `data` (image bytes) unless an identical image is already stored,
+        creating its thumbnail, and returns the digest.
+        """
+        digest = digest or image_digest(data)
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            # Refresh the age so the garbage collector leaves it to the new report
+            os.utime(path)
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Thumbnail first: an original on disk always has its thumbnail
+        thumbnail = self._thumbnail(data)
+        if thumbnail is not None:
+            self._write_atomic(self.path_for(digest, thumbnail=True), thumbnail)
+        self._write_atomic(path, data)
+        return digest
+
+    def delete(self, digest):
+        for path in (self.path_for(digest), self.path_for(digest, thumbnail=True)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def digests(self):
+        """
+        Yields (digest, modification time) for every stored original.
+        """
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if _DIGEST_RE.match(name):
+                    yield name, os.path.getmtime(os.path.join(directory, name))
+
+    def _thumbnail(self, data):
+        # Imported here: ml_integration pulls in the model stack
+        from utils.ml_integration import decode_image
+        try:
+            img = decode_image(data, target_size=(self.thumbnail_size, self.thumbnail_size))
+        except Exception as e:
+            logging.warning(f"Could not create thumbnail: {e}")
+            return None
+        height, width = img.shape[:2]
+        scale = self.thumbnail_size / max(height, width)
+        if scale < 1:
+            img = cv.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                            interpolation=cv.INTER_AREA)
+        ok, encoded = cv.imencode(".jpg", img, [cv.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+        return encoded.tobytes() if ok else None
+
+    @staticmethod
+    def _write_atomic(path, data):
+        # Write to a temp file in the same directory and rename, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(path, etag, range_header=None, if_none_match=None):
+    """
+    Streams a stored file with a strong ETag, answering If-None-Match with 304
+    and a single "bytes=" Range with 206. Stored files never change, so they are
+    cacheable forever.
+    """
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    etag = f'"{etag}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "public, max-age=31536000, immutable"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    with open(path, "rb") as f:
+        content_type = CONTENT_TYPES.get(sniff_format(f.read(8)), "application/octet-stream")
+    size = os.path.getsize(path)
+    start, end = 0, size - 1
+    status_code = 200
+    if range_header:
+        match = _RANGE_RE.match(range_header.strip())
+        if not match or not any(match.groups()):
+            raise HTTPException(status_code=416, detail="Invalid range", headers={"Content-Range": f"bytes */{size}"})
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, size - int(last))
+        if start > end or start >= size:
+            raise HTTPException(status_code=416, detail="Range not satisfiable",
+                                headers={"Content-Range": f"bytes */{size}"})
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_iter_file(path, start, end - start + 1), status_code=status_code,
+                             media_type=content_type, headers=headers)
+
+
+def collect_garbage(db, store, min_age_s=IMAGE_GC_MIN_AGE_S, dry_run=False):
+    """
+    Deletes stored images that no report references (reference count zero) and
+    that are older than `min_age_s`. Returns the counts of kept and removed images.
+    """
+    from sqlalchemy import func
+    from models import Report
+
+    references = dict(db.query(Report.image_hash, func.count(Report.id))
+                      .filter(Report.image_hash.isnot(None))
+                      .group_by(Report.image_hash).all())
+    cutoff = time.time() - min_age_s
+    kept = removed = 0
+    for digest, modified in store.digests():
+        if references.get(digest) or modified > cutoff:
+            kept += 1
+            continue
+        removed += 1
+        if not dry_run:
+            store.delete(digest)
+    logging.info(f"Image GC: kept {kept}, {'would remove' if dry_run else 'removed'} {removed}")
+    return {"kept": kept, "removed": removed, "dry_run": dry_run}
+
+
+# Shared store used by the upload endpoints
+image_store = ImageStore()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the content-addressed image store.")
+    parser.add_argument("--gc", action="store_true", help="delete images no report refers to")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--min-age", type=float, default=IMAGE_GC_MIN_AGE_S, help="seconds before an image can be collected")
+    args = parser.parse_args()
+
+    if args.gc:
+        from database import SessionLocal
+        db = SessionLocal()
+        try:
+            print(collect_garbage(db, image_store, args.min_age, args.dry_run))
+        finally:
+            db.close()
+    else:
+        parser.print_help()
@@ -0,0 +1,124 @@
+import os
+import threading
+import numpy as np
+
+# Backend name -> artifact file extension. Quantized artifacts live next to the
+# .keras file as <stem>.<variant>.<ext>, e.g. crop_disease_model_corn1.int8.tflite
+BACKEND_EXTENSIONS = {"tflite": ".tflite", "onnx": ".onnx"}
+QUANTIZATION_VARIANTS = ("float16", "int8")
+DEFAULT_VARIANT = "int8"
+
+
+def parse_backend_spec(spec):
+    """
+    Parses "keras", "tflite", "tflite:float16", "onnx:int8", ... into (backend, variant).
+    """
+    backend, _, variant = (spec or "keras").strip().lower().partition(":")
+    if backend == "keras":
+        return "keras", None
+    if backend not in BACKEND_EXTENSIONS:
+        raise ValueError(f"Unknown inference backend '{backend}'")
+    variant = variant or DEFAULT_VARIANT
+    if variant not in QUANTIZATION_VARIANTS:
+        raise ValueError(f"Unknown quantization variant '{variant}' for backend '{backend}'")
+    return backend, variant
+
+
+def artifact_path(keras_path, spec):
+    """
+    Path of the artifact that serves `spec` for the model at `keras_path`.
+    """
+    backend, variant = parse_backend_spec(spec)
+    if backend == "keras":
+        return keras_path
+    return f"{os.path.splitext(keras_path)[0]}.{variant}{BACKEND_EXTENSIONS[backend]}"
+
+
+def load_model_artifact(path):
+    """
+    Loads a model for inference, picking the runtime from the file extension.
+    Every returned object has a Keras-style predict(inputs, verbose=0).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".tflite":
+        return TFLiteBackend(path)
+    if extension == ".onnx":
+        return OnnxBackend(path)
+    from tensorflow.keras.models import load_model
+    return load_model(path)
+
+
+def fold_normalization(model):
+    """
+    Wraps a Keras model so it takes raw uint8 RGB input and does the 1/255
+    scaling inside the graph, which saves the float32 conversion on the host.
+    Returns None for models that are not Keras models.
+    """
+    if not hasattr(model, "input_shape") or not hasattr(model, "layers"):
+        return None
+    import tensorflow as tf
+    inputs = tf.keras.Input(shape=model.input_shape[1:], dtype="uint8")
+    outputs = model(tf.keras.layers.Rescaling(1.0 / 255)(inputs))
+    return tf.keras.Model(inputs, outputs)
+
+
+class TFLiteBackend:
+    """
+    Runs a .tflite model. Uses tflite_runtime when installed (much lighter to
+    import than TensorFlow) and falls back to tf.lite otherwise.
+    """
+    def __init__(self, path):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.path = path
+        self.nbytes = os.path.getsize(path)
+        self._interpreter = Interpreter(model_path=path)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def predict(self, inputs, verbose=0):
+        inputs = np.asarray(inputs, dtype=np.float32)
+        with self._lock:
+            if self._batch_size != len(inputs):
+                self._interpreter.resize_tensor_input(self._input["index"], [len(inputs), *inputs.shape[1:]])
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(inputs)
+            self._interpreter.set_tensor(self._input["index"], self._quantize(inputs))
+            self._interpreter.invoke()
+            return self._dequantize(self._interpreter.get_tensor(self._output["index"]))
+
+    def _quantize(self, inputs):
+        dtype = self._input["dtype"]
+        if dtype in (np.int8, np.uint8):
+            scale, zero_point = self._input["quantization"]
+            info = np.iinfo(dtype)
+            return np.clip(np.round(inputs / scale + zero_point), info.min, info.max).astype(dtype)
+        return inputs.astype(dtype)
+
+    def _dequantize(self, outputs):
+        if self._output["dtype"] in (np.int8, np.uint8):
+            scale, zero_point = self._output["quantization"]
+            return (outputs.astype(np.float32) - zero_point) * scale
+        return outputs.astype(np.float32)
+
+
+class OnnxBackend:
+    """
+    Runs an .onnx model on ONNX Runtime's CPU execution provider.
+    """
+    def __init__(self, path):
+        import onnxruntime as ort
+        self.path = path
+        self.nbytes = os.path.getsize(path)
+        self._session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self._input = self._session.get_inputs()[0]
+        self._input_dtype = np.float16 if self._input.type == "tensor(float16)" else np.float32
+
+    def predict(self, inputs, verbose=0):
+        inputs = np.asarray(inputs, dtype=self._input_dtype)
+        outputs = self._session.run(None, {self._input.name: inputs})[0]
+        return outputs.astype(np.float32)
@@ -0,0 +1,104 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# Admission-control knobs: how many requests decode/predict at once, how many may
+# wait behind them, and the default per-request deadline
+INFERENCE_MAX_CONCURRENCY = int(os.getenv("INFERENCE_MAX_CONCURRENCY", str(os.cpu_count() or 4)))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "64"))
+INFERENCE_TIMEOUT_S = float(os.getenv("INFERENCE_TIMEOUT_S", "30"))
+INFERENCE_RETRY_AFTER_S = int(os.getenv("INFERENCE_RETRY_AFTER_S", "1"))
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a request arrives while the executor is already at capacity.
+    """
+
+
+class DeadlineExceededError(Exception):
+    """
+    Raised when a request's deadline passes before its inference finished.
+    """
+
+
+def deadline_after(timeout=None):
+    """
+    Converts a timeout in seconds (default INFERENCE_TIMEOUT_S) to a monotonic deadline.
+    """
+    return time.monotonic() + (INFERENCE_TIMEOUT_S if timeout is None else float(timeout))
+
+
+class InferenceExecutor:
+    """
+    Runs blocking inference work off the event loop on a bounded thread pool.
+    At most `max_concurrency + max_queue` requests are admitted at a time; the
+    rest are rejected immediately with QueueFullError instead of piling up.
+    """
+    def __init__(self, max_concurrency=INFERENCE_MAX_CONCURRENCY, max_queue=INFERENCE_MAX_QUEUE, name="inference"):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._expired = 0
+
+    @contextmanager
+    def admit(self):
+        """
+        Reserves a slot for one request for the duration of the block.
+        """
+        with self._lock:
+            if self._in_flight >= self.max_concurrency + self.max_queue:
+                self._rejected += 1
+                raise QueueFullError("Inference queue is full")
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    async def run(self, fn, *args, deadline=None):
+        """
+        Runs fn(*args) on the pool. Work still queued when the deadline passes is
+        cancelled (or skipped when it reaches a worker) and DeadlineExceededError is raised.
+        """
+        future = self._pool.submit(self._call, deadline, fn, *args)
+        return await self.wait(future, deadline)
+
+    async def wait(self, future, deadline=None):
+        """
+        Awaits a concurrent.futures.Future, cancelling it if the deadline passes first.
+        """
+        timeout = None if deadline is None else deadline - time.monotonic()
+        try:
+            if timeout is not None and timeout <= 0:
+                raise asyncio.TimeoutError
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self._expired += 1
+            raise DeadlineExceededError("Inference deadline exceeded")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "queue_depth": self._pool._work_queue.qsize(),
+                "rejected": self._rejected,
+                "expired": self._expired,
+            }
+
+    def _call(self, deadline, fn, *args):
+        # The client may have given up while this sat in the queue
+        if deadline is not None and time.monotonic() > deadline:
+            raise DeadlineExceededError("Inference deadline exceeded before work started")
+        return fn(*args)
@@ -0,0 +1,164 @@
+"""
+Single-pass ingestion of uploaded images. The upload is read in chunks into one
+buffer under a hard byte cap; the format is checked from the magic bytes and the
+dimensions from the header as soon as those bytes arrive, so bogus or oversized
+images are rejected before the rest is read. The sha256 digest is computed as
+the chunks arrive, and the buffer is handed to decode as-is.
+"""
+import os
+import hashlib
+from dataclasses import dataclass
+from fastapi import HTTPException
+from utils.image_headers import sniff_format, image_dimensions
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+# Decoding cost and memory grow with the pixel count, not the (compressed) file size
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", str(50_000_000)))
+UPLOAD_MIN_SIDE = int(os.getenv("UPLOAD_MIN_SIDE", "16"))
+# The dimensions must appear within this many bytes; JPEG EXIF/ICC segments come before them
+UPLOAD_HEADER_LIMIT = int(os.getenv("UPLOAD_HEADER_LIMIT", str(256 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Room for multipart boundaries and the other form fields on top of the image itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadRejectedError(ValueError):
+    """
+    Raised when an upload is refused; `status_code` is the HTTP status to answer with.
+    """
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass(frozen=True)
+class IngestedImage:
+    data: bytearray
+    digest: str
+    image_format: str
+    width: int
+    height: int
+
+
+class ImageIngest:
+    """
+    Incremental validator: feed() each chunk as it arrives, then finish().
+    Raises UploadRejectedError from whichever call first sees a problem.
+    """
+    def __init__(self, max_bytes=UPLOAD_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.buffer = bytearray()
+        self.image_format = None
+        self.dimensions = None
+        self._hash = hashlib.sha256()
+
+    def feed(self, chunk):
+        if len(self.buffer) + len(chunk) > self.max_bytes:
+            raise UploadRejectedError(413, f"Image exceeds the {self.max_bytes} byte limit")
+        self.buffer += chunk
+        self._hash.update(chunk)
+        if self.image_format is None and len(self.buffer) >= 8:
+            self.image_format = sniff_format(self.buffer)
+            if self.image_format is None:
+                raise UploadRejectedError(415, "Unsupported image type. Only JPEG and PNG are allowed.")
+        if self.image_format and self.dimensions is None:
+            self._check_dimensions()
+
+    def finish(self):
+        if not self.buffer:
+            raise UploadRejectedError(400, "Empty upload")
+        if self.image_format is None:
+            raise UploadRejectedError(415, "Unsupported image type. Only JPEG and PNG are allowed.")
+        if self.dimensions is None:
+            raise UploadRejectedError(400, "Image header is truncated")
+        width, height = self.dimensions
+        return IngestedImage(self.buffer, self._hash.hexdigest(), self.image_format, width, height)
+
+    def _check_dimensions(self):
+        try:
+            self.dimensions = image_dimensions(self.buffer)
+        except ValueError as e:
+            raise UploadRejectedError(400, f"Corrupt image header: {e}")
+        if self.dimensions is None:
+            if len(self.buffer) > UPLOAD_HEADER_LIMIT:
+                raise UploadRejectedError(400, "Image dimensions not found in the header")
+            return
+        width, height = self.dimensions
+        if min(width, height) < UPLOAD_MIN_SIDE:
+            raise UploadRejectedError(422, f"Image is too small ({width}x{height})")
+        if width * height > UPLOAD_MAX_PIXELS:
+            raise UploadRejectedError(413, f"Image is too large ({width}x{height})")
+
+
+async def ingest_upload(upload, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    Reads an UploadFile chunk by chunk through ImageIngest; reading stops at the
+    first chunk that fails validation.
+    """
+    ingest = ImageIngest(max_bytes)
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return ingest.finish()
+        ingest.feed(chunk)
+
+
+def ingest_file(fileobj, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    Blocking variant of ingest_upload for a file-like object.
+    """
+    ingest = ImageIngest(max_bytes)
+    for chunk in iter(lambda: fileobj.read(UPLOAD_CHUNK_SIZE), b""):
+        ingest.feed(chunk)
+    return ingest.finish()
+
+
+def ingest_bytes(data, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    Validates bytes that are already in memory (e.g. an archive member).
+    """
+    ingest = ImageIngest(max_bytes)
+    ingest.feed(data)
+    return ingest.finish()
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware capping the request body of the single-image upload paths.
+    A declared Content-Length over the cap is refused before any of the body is
+    received; a chunked body is cut off as soon as it passes the cap.
+    """
+    def __init__(self, app, paths, max_bytes=UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the body parser; FastAPI turns it into the response
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = b'{"detail":"Request body too large"}'
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,173 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format (version
+0.0.4), served by main.py at /metrics. Kept dependency-free: histograms and
+counters are plain dicts of label values under a lock.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Seconds; spans a cache hit (sub-millisecond) to a cold model load
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}_total{_labels(self.labelnames, key)} {_number(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    Gauge whose samples are read from `collect()` at scrape time; it returns
+    {label values tuple: value}, or a plain number for an unlabelled gauge.
+    """
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, collect, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def _samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def process_rss_bytes():
+    """
+    Resident set size of this process; falls back to the peak RSS where /proc is missing.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+metrics_registry = MetricsRegistry()
+
+# Per-request stages of the prediction path: upload_read, decode, preprocess,
+# inference (queueing plus the batched forward pass), db_commit and total
+stage_seconds = metrics_registry.register(Histogram(
+    "crop_disease_stage_seconds", "Time spent in each stage of a prediction request.", ("stage", "crop_type")))
+batch_inference_seconds = metrics_registry.register(Histogram(
+    "crop_disease_batch_inference_seconds", "Duration of one batched model forward pass.", ("model",)))
+errors = metrics_registry.register(Counter(
+    "crop_disease_errors", "Prediction path errors by type.", ("type",)))
+cascade_answers = metrics_registry.register(Counter(
+    "crop_disease_cascade_answers", "Cascade predictions by the stage that answered.", ("crop_type", "stage")))
+metrics_registry.register(Gauge(
+    "crop_disease_process_resident_memory_bytes", "Resident memory of the server process.", process_rss_bytes))
@@ -1,21 +1,45 @@
 import cv2 as cv
 import numpy as np
-import matplotlib.pyplot as plt
-import tensorflow as tf
-from tensorflow.keras.models import load_model
 import os
+import time
+import logging
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from utils.model_registry import ModelRegistry, COMBINED_MODEL_PATH
+from utils.inference_executor import InferenceExecutor, DeadlineExceededError
+from utils.prediction_cache import PredictionCache, image_digest, cache_key
+from utils.image_headers import image_dimensions
+from utils.metrics import metrics_registry, Gauge, stage_seconds, batch_inference_seconds, errors, cascade_answers
+from utils.cascade import CascadePolicy, fast_model_path, top_k, FAST_STAGE, FULL_STAGE
+from utils.near_duplicates import upload_index, fingerprint
+from utils.profiling import profiler
 
 # Dataset directory
-dataset_dir = "C:/AI-Crop-Disease-App/ml_model/datasets/train"
-
-# Load models for different crops
-models = {
-    'apple': load_model("C:/AI-Crop-Disease-App/ml_model/model/apple_model/crop_disease_model_apple.keras"),
-    'cherry': load_model("C:/AI-Crop-Disease-App/ml_model/model/cherry_model/crop_disease_model_cherry.keras"),
-    'corn': load_model("C:/AI-Crop-Disease-App/ml_model/model/corn_model/crop_disease_model_corn1.keras"),
-    'grape': load_model("C:/AI-Crop-Disease-App/ml_model/model/grape_model/crop_disease_model_grape.keras"),
-    'tomato': load_model("C:/AI-Crop-Disease-App/ml_model/model/tomato_model/crop_disease_model_tomato.keras")
-}
+dataset_dir = os.getenv("DATASET_DIR", "C:/AI-Crop-Disease-App/ml_model/datasets/train")
+
+# Shared model registry: models are loaded on first use and kept within the
+# MODEL_MAX_RESIDENT / MODEL_MAX_BYTES limits (see utils/model_registry.py)
+registry = ModelRegistry.from_env()
+
+# "separate" serves one model per crop; "combined" serves a single multi-crop graph
+# with one classification head per crop, so requests for different crops share a batch
+MODEL_SERVING_MODE = os.getenv("MODEL_SERVING_MODE", "separate").lower()
+COMBINED_MODEL = "combined"
+combined_registry = ModelRegistry({COMBINED_MODEL: COMBINED_MODEL_PATH},
+                                  fold_normalization=registry.fold_normalization)
+
+# Optional cheap first-stage models (see utils/cascade.py), one per crop, queued
+# under FAST_KEY_PREFIX + crop type
+FAST_KEY_PREFIX = "fast:"
+fast_registry = ModelRegistry({crop: fast_model_path(path) for crop, path in registry.manifest.items()},
+                              fold_normalization=registry.fold_normalization)
+cascade = CascadePolicy(fast_registry.manifest)
+
+# Crop type for callers that do not know the crop: every crop head is scored and
+# the most confident one wins
+AUTO_CROP_TYPE = "auto"
 
 # Define class names for each crop
 class_names = {
@@ -46,6 +70,35 @@ class_names = {
     ]
 }
 
+# Dataset folder name -> (crop type, label in class_names). The folder names in
+# ml_model/datasets/train do not match the model labels, so this is kept explicit.
+dataset_class_map = {
+    'Apple___Apple_scab': ('apple', 'Apple_Scab'),
+    'Apple___Black_rot': ('apple', 'Apple_BlackRot'),
+    'Apple___Cedar_apple_rust': ('apple', 'Apple_Cedar_apple_rust'),
+    'Apple___healthy': ('apple', 'Apple_Healthy'),
+    'Cherry_(including_sour)___Powdery_mildew': ('cherry', 'Cherry_(including_sour)_Powdery_mildew'),
+    'Cherry_(including_sour)___healthy': ('cherry', 'Cherry_(including_sour)_healthy'),
+    'Corn_(maize)___Cercospora_leaf_spot Gray_leaf_spot': ('corn', 'Corn_(maize)_Cercospora_leaf_spot Gray_leaf_spot'),
+    'Corn_(maize)___Common_rust_': ('corn', 'Corn_(maize)Common_rust'),
+    'Corn_(maize)___Northern_Leaf_Blight': ('corn', 'Corn_(maize)Northern_Leaf_Blight'),
+    'Corn_(maize)___healthy': ('corn', 'Corn_(maize)_healthy'),
+    'Grape___Black_rot': ('grape', 'Grape_Black_rot'),
+    'Grape___Esca_(Black_Measles)': ('grape', 'Grape_Esca(Black_Measels)'),
+    'Grape___Leaf_blight_(Isariopsis_Leaf_Spot)': ('grape', 'Grape_leaf_blight(Isariopsis_leaf_spot)'),
+    'Grape___healthy': ('grape', 'Grape_healthy'),
+    'Tomato___Bacterial_spot': ('tomato', 'Tomato__Bacterial_spot'),
+    'Tomato___Early_blight': ('tomato', 'Tomato_Early_blight'),
+    'Tomato___healthy': ('tomato', 'Tomato_healthy'),
+    'Tomato___Late_blight': ('tomato', 'Tomato_Late_blight'),
+    'Tomato___Leaf_Mold': ('tomato', 'Tomato_Leaf_Mold'),
+    'Tomato___Septoria_leaf_spot': ('tomato', 'Tomato_Septoria_leaf_spot'),
+    'Tomato___Spider_mites Two-spotted_spider_mite': ('tomato', 'Tomato_Spider_mites Two-spotted_spider_mite'),
+    'Tomato___Target_Spot': ('tomato', 'Tomato_Target_Spot'),
+    'Tomato___Tomato_mosaic_virus': ('tomato', 'Tomato__Tomato_mosaic_virus'),
+    'Tomato___Tomato_Yellow_Leaf_Curl_Virus': ('tomato', 'Tomato_Tomato_Yellow_Leaf_Curl_Virus'),
+}
+
 # Define disease information for each crop
 disease_info = {
     'Corn_(maize)_Cercospora_leaf_spot Gray_leaf_spot': {
@@ -122,74 +175,675 @@ disease_info = {
     }
 }
 
+# Decode large JPEGs at a reduced DCT scale when they are much bigger than the model input
+DECODE_REDUCED = os.getenv("DECODE_REDUCED", "true").lower() == "true"
+
+# "background" loads and warms the startup set (MODEL_PRELOAD, every crop when that
+# is unset, or the combined model) on a thread once the server is accepting
+# connections, with progress on /health/ready; "eager" finishes before the server
+# starts serving
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background").lower()
+
+# Micro-batching knobs: largest batch per forward pass and how long the first
+# request of a batch may wait for others to arrive
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+
+def _reduced_decode_flag(image, target_size):
+    """
+    Picks the largest IMREAD_REDUCED_COLOR_* factor that still leaves the image
+    at least `target_size`, so e.g. a 12MP JPEG is DCT-scaled at decode time
+    instead of being fully decoded and then thrown away by the resize.
+    """
+    if not DECODE_REDUCED:
+        return cv.IMREAD_COLOR
+    dimensions = image_dimensions(image)
+    if dimensions is None:
+        return cv.IMREAD_COLOR
+    width, height = dimensions
+    flag = cv.IMREAD_COLOR
+    for factor, reduced_flag in ((2, cv.IMREAD_REDUCED_COLOR_2), (4, cv.IMREAD_REDUCED_COLOR_4),
+                                 (8, cv.IMREAD_REDUCED_COLOR_8)):
+        if width // factor >= target_size[0] and height // factor >= target_size[1]:
+            flag = reduced_flag
+    return flag
+
+def decode_image(image, target_size=None):
+    """
+    Decodes an image given as a file path or as an in-memory buffer
+    (bytes, bytearray or memoryview) into a BGR array. With `target_size` the
+    decoder may return a reduced-resolution image that is still at least that big.
+    """
+    if not isinstance(image, (bytes, bytearray, memoryview)):
+        if not os.path.exists(image):
+            raise FileNotFoundError(f"Image not found at {image}")
+        image = np.fromfile(image, dtype=np.uint8)
+    buffer = np.frombuffer(image, dtype=np.uint8)
+    flag = _reduced_decode_flag(buffer, target_size) if target_size else cv.IMREAD_COLOR
+    img = cv.imdecode(buffer, flag)
+    if img is None:
+        raise ValueError("Could not decode image data")
+    return img
+
+def prepare_frame(image, target_size=(180, 180), timings=None):
+    """
+    Decodes `image` (path or bytes) and resizes it to `target_size`, returning a
+    BGR uint8 frame. Colour conversion and normalisation are left to the batch
+    scheduler, which does both while copying frames into its input buffer.
+    When given, `timings` receives the "decode" and "preprocess" seconds.
+    """
+    try:
+        started = time.perf_counter()
+        img = decode_image(image, target_size)
+        decoded = time.perf_counter()
+        frame = cv.resize(img, target_size)
+        if timings is not None:
+            timings["decode"] = decoded - started
+            timings["preprocess"] = time.perf_counter() - decoded
+        return frame
+    except Exception as e:
+        raise RuntimeError(f"Error processing image: {e}")
+
+def load_rgb_image(image, target_size=(180, 180)):
+    """
+    Decodes `image` (path or bytes) and returns it as an RGB uint8 array of `target_size`.
+    """
+    img = cv.resize(decode_image(image, target_size), target_size)
+    return cv.cvtColor(img, cv.COLOR_BGR2RGB, dst=img)
+
 # Function to preprocess the image
-def preprocess_image(img_path, target_size=(180, 180)):
+def preprocess_image(image, target_size=(180, 180)):
     """
-    Preprocess the image to be used by the model.
+    Preprocess the image to be used by the model. `image` is a path or the raw
+    encoded bytes, so uploads can be decoded without touching the disk.
     """
     try:
-        img = cv.imread(img_path)
-        if img is None:
-            raise FileNotFoundError(f"Image not found at {img_path}")
-        img = cv.cvtColor(img, cv.COLOR_BGR2RGB)
-        img_resized = cv.resize(img, target_size)
-        img_array = np.array([img_resized]) / 255.0  # Normalize the image
+        img_resized = load_rgb_image(image, target_size)
+        img_array = np.multiply(img_resized[np.newaxis], np.float32(1 / 255.0), dtype=np.float32)  # Normalize the image
         return img_resized, img_array
     except Exception as e:
         raise RuntimeError(f"Error processing image: {e}")
 
+class BatchScheduler:
+    """
+    Queues prediction requests per crop type and coalesces them into batches
+    of up to `max_batch_size` images (or whatever arrived within `max_wait_ms`),
+    runs a single forward pass and fans the results back to each caller.
+    """
+    def __init__(self, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 combined=MODEL_SERVING_MODE == "combined"):
+        self.combined = combined
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._requests = 0
+        self._batches = 0
+
+    def configure(self, max_batch_size=None, max_wait_ms=None):
+        """
+        Adjust the batching knobs at runtime; queued requests pick them up on the next batch.
+        """
+        if max_batch_size is not None:
+            self.max_batch_size = max(1, int(max_batch_size))
+        if max_wait_ms is not None:
+            self.max_wait_ms = max(0.0, float(max_wait_ms))
+
+    def submit(self, crop_type, frame, inline=False, fast=False):
+        """
+        Queue a resized BGR uint8 frame (see prepare_frame) and return a Future
+        for its prediction row. In combined mode every crop goes through one
+        queue, and AUTO_CROP_TYPE resolves to {crop_type: row} for every head.
+        With `fast` the crop's first-stage cascade model scores it instead.
+        With `inline` the frame is run as a batch of one on the calling thread,
+        e.g. so a profiler attached to that thread sees the forward pass.
+        """
+        if crop_type == AUTO_CROP_TYPE and not self.combined:
+            raise ValueError("The auto crop type needs the combined model; use submit_prediction")
+        future = Future()
+        if fast:
+            key = FAST_KEY_PREFIX + crop_type
+        else:
+            key = COMBINED_MODEL if self.combined else crop_type
+        if inline:
+            self._run_batch(key, [(crop_type, frame, future)], {})
+        else:
+            self._queue_for(key).put((crop_type, frame, future))
+        return future
+
+    def stats(self):
+        """
+        Counters for the batch sizes achieved so far.
+        """
+        with self._lock:
+            sizes = dict(sorted(self._batch_sizes.items()))
+            requests, batches = self._requests, self._batches
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": round(requests / batches, 2) if batches else 0.0,
+            "batch_size_counts": sizes,
+            "queue_depth": {crop: q.qsize() for crop, q in self._queues.items()},
+        }
+
+    def _queue_for(self, key):
+        with self._lock:
+            q = self._queues.get(key)
+            if q is None:
+                q = queue.Queue()
+                self._queues[key] = q
+                worker = threading.Thread(target=self._worker, args=(key, q),
+                                          name=f"batcher-{key}", daemon=True)
+                worker.start()
+            return q
+
+    def _worker(self, key, q):
+        # Input buffers owned by this worker thread and reused across batches
+        buffers = {}
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.max_wait_ms / 1000.0
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(key, batch, buffers)
+
+    def _fill_buffer(self, buffers, frames, uint8_input):
+        dtype = np.uint8 if uint8_input else np.float32
+        shape = (max(self.max_batch_size, len(frames)), *frames[0].shape)
+        buffer = buffers.get(dtype)
+        if buffer is None or buffer.shape[0] < len(frames) or buffer.shape[1:] != shape[1:]:
+            buffer = buffers[dtype] = np.empty(shape, dtype=dtype)
+        for i, frame in enumerate(frames):
+            # BGR -> RGB via a reversed channel view, scaled straight into the buffer
+            if uint8_input:
+                buffer[i] = frame[..., ::-1]
+            else:
+                np.multiply(frame[..., ::-1], np.float32(1 / 255.0), out=buffer[i])
+        return buffer[:len(frames)]
+
+    def _run_batch(self, key, batch, buffers):
+        # Skip requests whose caller already gave up
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            models, name = models_for(key)
+            model = models.get(name)
+            inputs = self._fill_buffer(buffers, [frame for _, frame, _ in batch], models.accepts_uint8(name))
+            with batch_inference_seconds.time(model=key):
+                outputs = model.predict(inputs, verbose=0)
+            if key == COMBINED_MODEL:
+                heads = head_outputs(model, outputs)
+                rows = [{crop: head[i] for crop, head in heads.items()} if crop_type == AUTO_CROP_TYPE
+                        else heads[crop_type][i] for i, (crop_type, _, _) in enumerate(batch)]
+            else:
+                rows = np.array(outputs)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            self._requests += len(batch)
+            self._batches += 1
+        for (_, _, future), row in zip(batch, rows):
+            future.set_result(row)
+
+def models_for(key):
+    """
+    The registry and model name behind a scheduler queue key.
+    """
+    if key == COMBINED_MODEL:
+        return combined_registry, key
+    if key.startswith(FAST_KEY_PREFIX):
+        return fast_registry, key[len(FAST_KEY_PREFIX):]
+    return registry, key
+
+def head_outputs(model, outputs):
+    """
+    Returns {crop_type: (n, classes) array} from a combined model's predict output.
+    """
+    if isinstance(outputs, dict):
+        return {crop: np.asarray(head) for crop, head in outputs.items()}
+    return {crop: np.asarray(head) for crop, head in zip(model.output_names, outputs)}
+
+def _gather_futures(futures):
+    """
+    Future resolving to {key: result} once every future in `futures` is done.
+    Cancelling it cancels the ones still queued.
+    """
+    gathered = Future()
+    lock = threading.Lock()
+    remaining = [len(futures)]
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        if not gathered.set_running_or_notify_cancel():
+            return
+        try:
+            gathered.set_result({key: future.result() for key, future in futures.items()})
+        except BaseException as e:
+            gathered.set_exception(e)
+
+    for future in futures.values():
+        future.add_done_callback(on_done)
+    gathered.add_done_callback(lambda g: g.cancelled() and [future.cancel() for future in futures.values()])
+    return gathered
+
+def _map_future(future, fn):
+    """
+    Future resolving to fn(result) of `future`; cancelling it cancels `future`.
+    """
+    mapped = Future()
+
+    def on_done(done):
+        if not mapped.set_running_or_notify_cancel():
+            return
+        try:
+            mapped.set_result(fn(done.result()))
+        except BaseException as e:
+            mapped.set_exception(e)
+
+    future.add_done_callback(on_done)
+    mapped.add_done_callback(lambda m: m.cancelled() and future.cancel())
+    return mapped
+
+# Shared scheduler used by every prediction entry point
+scheduler = BatchScheduler()
+
+# Bounded pool that keeps decoding and waiting for predictions off the event loop
+executor = InferenceExecutor()
+
+# Results keyed on image bytes, crop type and model version
+prediction_cache = PredictionCache()
+
+# Scrape-time gauges for /metrics
+metrics_registry.register(Gauge(
+    "crop_disease_resident_models", "Models currently loaded in memory.",
+    lambda: len(registry.stats()["resident"]) + len(combined_registry.stats()["resident"])))
+metrics_registry.register(Gauge(
+    "crop_disease_resident_model_bytes", "Estimated memory held by loaded models.",
+    lambda: registry.stats()["resident_bytes"] + combined_registry.stats()["resident_bytes"]))
+metrics_registry.register(Gauge(
+    "crop_disease_executor_in_flight", "Requests admitted to the inference executor.",
+    lambda: executor.stats()["in_flight"]))
+metrics_registry.register(Gauge(
+    "crop_disease_executor_queue_depth", "Decode jobs waiting for an inference executor thread.",
+    lambda: executor.stats()["queue_depth"]))
+metrics_registry.register(Gauge(
+    "crop_disease_batch_queue_depth", "Frames waiting in the batch scheduler, per model queue.",
+    lambda: {(key,): depth for key, depth in scheduler.stats()["queue_depth"].items()}, ("model",)))
+
+def is_supported_crop(crop_type):
+    return crop_type in registry or crop_type == AUTO_CROP_TYPE
+
+def submit_prediction(crop_type, frame, inline=False):
+    """
+    Queues `frame` for `crop_type` (or runs it on this thread with `inline`).
+    Without the combined model, the auto crop type fans out to every crop model
+    and gathers their rows.
+    """
+    if crop_type == AUTO_CROP_TYPE and not scheduler.combined:
+        return _gather_futures({crop: scheduler.submit(crop, frame, inline) for crop in registry.crop_types()})
+    return scheduler.submit(crop_type, frame, inline)
+
+def submit_staged(crop_type, frame, inline=False):
+    """
+    Like submit_prediction, but resolves to (row, stage). Crops with an active
+    cascade are scored by the fast model first and only escalated to the full
+    model when its top-1 probability is below the crop's threshold.
+    """
+    if scheduler.combined:
+        return _map_future(submit_prediction(crop_type, frame, inline), lambda row: (row, COMBINED_MODEL))
+    if not cascade.enabled_for(crop_type):
+        return _map_future(submit_prediction(crop_type, frame, inline), lambda row: (row, FULL_STAGE))
+
+    staged = Future()
+    current = [scheduler.submit(crop_type, frame, inline, fast=True)]
+
+    def finish(row, stage):
+        if staged.set_running_or_notify_cancel():
+            cascade.record(crop_type, stage)
+            cascade_answers.inc(crop_type=crop_type, stage=stage)
+            staged.set_result((row, stage))
+
+    def on_full(done):
+        try:
+            row = done.result()
+        except BaseException as e:
+            if staged.set_running_or_notify_cancel():
+                staged.set_exception(e)
+            return
+        finish(row, FULL_STAGE)
+
+    def on_fast(done):
+        if staged.cancelled():
+            return
+        try:
+            row = done.result()
+            if cascade.accepts(crop_type, row):
+                finish(row, FAST_STAGE)
+                return
+        except BaseException as e:
+            # A broken fast model must not fail the request; the full model still answers
+            logging.warning(f"Fast model for '{crop_type}' failed, using the full model: {e}")
+        current[0] = scheduler.submit(crop_type, frame, inline)
+        current[0].add_done_callback(on_full)
+        if staged.cancelled():
+            current[0].cancel()
+
+    current[0].add_done_callback(on_fast)
+    staged.add_done_callback(lambda s: s.cancelled() and current[0].cancel())
+    return staged
+
+def model_version(crop_type):
+    """
+    Version of whatever model(s) answer for `crop_type`, used in cache keys.
+    """
+    if scheduler.combined:
+        return combined_registry.model_version(COMBINED_MODEL)
+    if crop_type == AUTO_CROP_TYPE:
+        return "+".join(registry.model_version(crop) for crop in registry.crop_types())
+    if cascade.enabled_for(crop_type):
+        # Cached answers go stale when the fast model or its threshold changes too
+        return (f"{registry.model_version(crop_type)}+{fast_registry.model_version(crop_type)}"
+                f"-{cascade.version(crop_type)}")
+    return registry.model_version(crop_type)
+
+def warm_up(key, batch_sizes=None):
+    """
+    Loads a model (a scheduler key: crop type, fast model or COMBINED_MODEL) and runs
+    dummy batches through it, so graph tracing for the serving batch sizes happens
+    before real traffic.
+    """
+    models, name = models_for(key)
+    model = models.get(name)
+    dtype = np.uint8 if models.accepts_uint8(name) else np.float32
+    for size in batch_sizes or sorted({1, scheduler.max_batch_size}):
+        model.predict(np.zeros((size, 180, 180, 3), dtype=dtype), verbose=0)
+
+class ModelWarmup:
+    """
+    Tracks loading and warm-up of the startup model set for the readiness probe.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = {}
+        self._thread = None
+
+    def targets(self):
+        """
+        Scheduler keys warmed at startup: the MODEL_PRELOAD crops or, when that is
+        unset, every crop (up to MODEL_MAX_RESIDENT, so warming does not evict the
+        models it just loaded), plus their cascade fast models.
+        """
+        if scheduler.combined:
+            return [COMBINED_MODEL]
+        crops = list(registry.preload_crops)
+        if not crops:
+            crops = registry.crop_types()
+            if registry.max_models:
+                crops = crops[:registry.max_models]
+        return crops + [FAST_KEY_PREFIX + crop for crop in crops if cascade.enabled_for(crop)]
+
+    def run(self):
+        targets = self.targets()
+        with self._lock:
+            for key in targets:
+                self._status.setdefault(key, {"state": "pending"})
+        for key in targets:
+            self._set(key, state="warming")
+            started = time.perf_counter()
+            try:
+                warm_up(key)
+                self._set(key, state="ready", seconds=round(time.perf_counter() - started, 3))
+            except Exception as e:
+                logging.error(f"Warm-up of '{key}' failed: {e}")
+                self._set(key, state="failed", error=str(e))
+
+    def start(self):
+        """
+        Runs the warm-up on a background thread (once).
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            for key in self.targets():
+                self._status.setdefault(key, {"state": "pending"})
+            self._thread = threading.Thread(target=self.run, name="model-warmup", daemon=True)
+        self._thread.start()
+
+    def status(self):
+        with self._lock:
+            models = {key: dict(info) for key, info in self._status.items()}
+        ready = all(info["state"] == "ready" for info in models.values())
+        if not scheduler.combined:
+            # Crops outside the startup set load on their first request and do not gate readiness
+            for crop in registry.crop_types():
+                models.setdefault(crop, {"state": "lazy"})
+        return {"ready": ready, "models": models}
+
+    def _set(self, key, **info):
+        with self._lock:
+            self._status[key] = info
+
+warmup = ModelWarmup()
+
+def start_model_warmup():
+    """
+    Loads and warms the startup model set according to STARTUP_MODE.
+    """
+    if STARTUP_MODE == "eager":
+        warmup.run()
+    else:
+        warmup.start()
+
+def serving_stats():
+    stats = registry.stats()
+    stats["serving_mode"] = MODEL_SERVING_MODE
+    if scheduler.combined:
+        stats["combined"] = combined_registry.stats()
+    stats["cascade"] = cascade.stats()
+    if cascade.enabled:
+        stats["fast"] = fast_registry.stats()
+    return stats
+
+def format_prediction(crop_type, prediction):
+    """
+    Maps a model output row to the disease label and its management information,
+    with the PREDICTION_TOP_K most probable labels.
+    """
+    index = np.argmax(prediction)
+
+    # Get the predicted label
+    predicted_label = class_names[crop_type][index]
+    logging.debug(f'Prediction: {predicted_label}')
+    ranked = top_k(class_names[crop_type], prediction)
+
+    # Fetch and return preventive measures and medications
+    if predicted_label in disease_info:
+        preventive_measures = disease_info[predicted_label]['Preventive Measures']
+        medications = disease_info[predicted_label]['Medications']
+        return {
+            "disease": predicted_label,
+            "confidence": ranked[0]["probability"],
+            "top_k": ranked,
+            "solution": {
+                "Preventive Measures": preventive_measures,
+                "Medications": medications
+            }
+        }
+    else:
+        return {
+            "disease": predicted_label,
+            "confidence": ranked[0]["probability"],
+            "top_k": ranked,
+            "solution": "No information available for this disease."
+        }
+
+def format_auto_prediction(rows):
+    """
+    Picks the crop head with the most confident top-1 class from {crop_type: row}
+    and formats it, adding the detected crop type to the result.
+    """
+    crop_type = max(rows, key=lambda crop: float(np.max(rows[crop])))
+    result = format_prediction(crop_type, rows[crop_type])
+    result["crop_type"] = crop_type
+    return result
+
+def format_result(crop_type, prediction, stage=None):
+    """
+    Formats a row (or {crop_type: row} for auto); `stage` records which model answered.
+    """
+    if crop_type == AUTO_CROP_TYPE:
+        result = format_auto_prediction(prediction)
+    else:
+        result = format_prediction(crop_type, prediction)
+    if stage:
+        result["stage"] = stage
+    return result
+
 # Prediction function for a given crop type
-def predict_disease(crop_type, img_path):
+def predict_disease(crop_type, image, inline=False):
     """
     Predicts the disease for a given crop type using the appropriate model.
+    `image` is a file path or the encoded image bytes. With `inline` the model
+    runs on the calling thread instead of the batch scheduler's.
     """
-    if crop_type not in models:
+    if not is_supported_crop(crop_type):
         print(f"Error: No model available for the crop type '{crop_type}'")
         return {"disease": "Unknown", "solution": "No solution provided"}
 
-    model = models[crop_type]
-    class_names_list = class_names[crop_type]
-
     try:
-        # Preprocess the image
-        img_resized, img_array = preprocess_image(img_path)
-
-        # Display the image (useful for debugging, can be disabled in production)
-        # plt.imshow(img_resized)
-        # plt.axis('off')
-        # plt.show()
-
-        # Make the prediction
-        prediction = model.predict(img_array)
-        index = np.argmax(prediction)
-
-        # Get the predicted label
-        predicted_label = class_names_list[index]
-        print(f'Prediction: {predicted_label}')
-
-        # Fetch and return preventive measures and medications
-        if predicted_label in disease_info:
-            preventive_measures = disease_info[predicted_label]['Preventive Measures']
-            medications = disease_info[predicted_label]['Medications']
-            return {
-                "disease": predicted_label,
-                "solution": {
-                    "Preventive Measures": preventive_measures,
-                    "Medications": medications
-                }
-            }
-        else:
-            return {
-                "disease": predicted_label,
-                "solution": "No information available for this disease."
-            }
+        # Decode and resize the image
+        frame = prepare_frame(image)
+
+        # Make the prediction through the batching scheduler
+        prediction, stage = submit_staged(crop_type, frame, inline).result()
+        return format_result(crop_type, prediction, stage)
 
     except Exception as e:
         return {"error": str(e)}
 
+def _near_duplicate(user_id, frame, crop_type, version):
+    """
+    (fingerprint, earlier upload or None) for a signed-in upload, (None, None) otherwise.
+    """
+    if user_id is None or not upload_index.enabled:
+        return None, None
+    near_key = fingerprint(frame)
+    return near_key, upload_index.lookup(user_id, near_key, crop_type, version)
+
+def _decode_and_predict_inline(crop_type, image, timings, user_id, version):
+    """
+    The decode, near-duplicate lookup and forward pass of predict_disease_async as
+    one job on the calling thread (the forward pass inline), so a profiler attached
+    to that thread sees all of them. Returns (near_key, match, (row, stage) or None).
+    """
+    frame = prepare_frame(image, (180, 180), timings)
+    near_key, match = _near_duplicate(user_id, frame, crop_type, version)
+    if match is not None:
+        return near_key, match, None
+    started = time.perf_counter()
+    staged = submit_staged(crop_type, frame, inline=True).result()
+    timings["inference"] = time.perf_counter() - started
+    return near_key, match, staged
+
+async def predict_disease_async(crop_type, image, deadline=None, image_hash=None, user_id=None, use_cache=True,
+                                profile_name=None):
+    """
+    Same as predict_disease, but decodes on the bounded inference executor and
+    awaits the batched forward pass, so the event loop is never blocked and
+    concurrent requests share a batch. Raises QueueFullError when the executor
+    is at capacity and DeadlineExceededError once `deadline` (monotonic) passes.
+
+    Results for in-memory images are served from the prediction cache when the
+    same bytes were already scored by the current model; `image_hash` may carry
+    a precomputed sha256 of the bytes. With a `user_id`, a near-identical photo
+    that user uploaded earlier (see utils/near_duplicates.py) reuses its prediction.
+    `use_cache=False` skips the prediction cache, e.g. for camera frames that are
+    never sent twice. With `profile_name` the decode and an inline forward pass run
+    under the profiler (see utils/profiling.py); admission, deadline and caching
+    are the same as for any other request.
+    """
+    if not is_supported_crop(crop_type):
+        print(f"Error: No model available for the crop type '{crop_type}'")
+        return {"disease": "Unknown", "solution": "No solution provided"}
+
+    key = version = None
+    if use_cache and prediction_cache.enabled and isinstance(image, (bytes, bytearray, memoryview)):
+        version = model_version(crop_type)
+        prediction_cache.check_version(crop_type, version)
+        key = cache_key(image_hash or image_digest(image), crop_type, version)
+        cached = prediction_cache.get_memory(key)
+        if cached is not None:
+            return cached
+
+    with executor.admit():
+        try:
+            if key and prediction_cache.persistent:
+                cached = await executor.run(prediction_cache.get_persistent, key, deadline=deadline)
+                if cached is not None:
+                    return cached
+            if key:
+                prediction_cache.record_miss()
+
+            if user_id is not None and version is None:
+                version = model_version(crop_type)
+            timings = {}
+            staged = None
+            if profile_name:
+                near_key, match, staged = await executor.run(
+                    profiler.run, profile_name, _decode_and_predict_inline, crop_type, image, timings, user_id,
+                    version, deadline=deadline)
+            else:
+                frame = await executor.run(prepare_frame, image, (180, 180), timings, deadline=deadline)
+                near_key, match = _near_duplicate(user_id, frame, crop_type, version)
+            for stage, seconds in timings.items():
+                stage_seconds.observe(seconds, stage=stage, crop_type=crop_type)
+
+            if match is not None:
+                return dict(match["result"], stage="near_duplicate",
+                            near_duplicate={"image_hash": match["image_hash"], "distance": match["distance"]})
+
+            if staged is None:
+                with stage_seconds.time(stage="inference", crop_type=crop_type):
+                    staged = await executor.wait(submit_staged(crop_type, frame), deadline)
+            prediction, stage = staged
+            result = format_result(crop_type, prediction, stage)
+
+            if near_key is not None:
+                upload_index.add(user_id, near_key, crop_type, version, result, image_hash)
+
+            if key:
+                if prediction_cache.persistent:
+                    await executor.run(prediction_cache.put, key, crop_type, version, result)
+                else:
+                    prediction_cache.put(key, crop_type, version, result)
+            return result
+
+        except DeadlineExceededError:
+            raise
+        except Exception as e:
+            errors.inc(type=type(e).__name__)
+            return {"error": str(e)}
+
 # Main logic for integration
 if __name__ == '__main__':
-    crop_type = input("Enter crop type (corn, grape, tomato, apple, cherry): ").strip().lower()
+    crop_type = input("Enter crop type (corn, grape, tomato, apple, cherry, auto): ").strip().lower()
     img_path = input("Enter the image path: ").strip()
 
     # Validate the image path
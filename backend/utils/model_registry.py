@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from utils.inference_backends import load_model_artifact, artifact_path, parse_backend_spec, fold_normalization
+
+# Where the per-crop .keras files live unless a manifest says otherwise
+MODEL_DIR = os.getenv("MODEL_DIR", "C:/AI-Crop-Disease-App/ml_model/model")
+
+# Multi-crop graph with per-crop heads built by utils/multi_crop.py, served when
+# MODEL_SERVING_MODE=combined
+COMBINED_MODEL_PATH = os.getenv("COMBINED_MODEL_PATH",
+                                os.path.join(MODEL_DIR, "combined_model/crop_disease_model_combined.keras"))
+
+# Default model files, relative to MODEL_DIR
+DEFAULT_MODEL_FILES = {
+    "apple": "apple_model/crop_disease_model_apple.keras",
+    "cherry": "cherry_model/crop_disease_model_cherry.keras",
+    "corn": "corn_model/crop_disease_model_corn1.keras",
+    "grape": "grape_model/crop_disease_model_grape.keras",
+    "tomato": "tomato_model/crop_disease_model_tomato.keras",
+}
+
+
+def load_manifest(manifest_path=None, model_dir=MODEL_DIR):
+    """
+    Returns {crop_type: model_path}. A JSON manifest (MODEL_MANIFEST) may map a crop
+    either to a path or to {"path": ...}; relative paths are resolved against the
+    manifest's directory. Without a manifest the default files under MODEL_DIR are used.
+    """
+    manifest_path = manifest_path or os.getenv("MODEL_MANIFEST")
+    if not manifest_path:
+        return {crop: os.path.join(model_dir, rel) for crop, rel in DEFAULT_MODEL_FILES.items()}
+
+    with open(manifest_path) as f:
+        entries = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    manifest = {}
+    for crop, entry in entries.items():
+        path = entry["path"] if isinstance(entry, dict) else entry
+        manifest[crop] = path if os.path.isabs(path) else os.path.join(base_dir, path)
+    return manifest
+
+
+def load_backend_specs(crop_types, manifest_path=None):
+    """
+    Returns {crop_type: backend spec} ("keras", "tflite:int8", "onnx:float16", ...).
+    MODEL_BACKEND sets the default, a manifest entry's "backend" key overrides it,
+    and MODEL_BACKEND_<CROP> (e.g. MODEL_BACKEND_CORN) overrides both, so
+    quantized backends can be rolled out one crop at a time.
+    """
+    default = os.getenv("MODEL_BACKEND", "keras")
+    entries = {}
+    manifest_path = manifest_path or os.getenv("MODEL_MANIFEST")
+    if manifest_path:
+        with open(manifest_path) as f:
+            entries = json.load(f)
+
+    specs = {}
+    for crop in crop_types:
+        entry = entries.get(crop)
+        spec = entry.get("backend", default) if isinstance(entry, dict) else default
+        spec = os.getenv(f"MODEL_BACKEND_{crop.upper()}", spec)
+        parse_backend_spec(spec)  # fail fast on typos
+        specs[crop] = spec
+    return specs
+
+
+def _env_list(name):
+    return [item.strip() for item in os.getenv(name, "").split(",") if item.strip()]
+
+
+def _model_nbytes(model):
+    """
+    Bytes held by the model's weights, used as its resident-memory estimate.
+    """
+    if getattr(model, "nbytes", None) is not None:
+        return int(model.nbytes)
+    try:
+        return int(sum(weight.numpy().nbytes for weight in model.weights))
+    except Exception:
+        return 0
+
+
+class ModelRegistry:
+    """
+    Loads crop models on first use and keeps at most `max_models` of them (or
+    `max_bytes` of weights) resident, evicting the least recently used one.
+    A value of 0 disables the corresponding limit.
+    """
+    def __init__(self, manifest, loader=load_model_artifact, max_models=0, max_bytes=0, preload=(), backends=None,
+                 fold_normalization=False):
+        self.manifest = dict(manifest)
+        self.loader = loader
+        self.fold_normalization = fold_normalization
+        self.backends = {crop: "keras" for crop in self.manifest}
+        self.backends.update(backends or {})
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.preload_crops = [crop for crop in preload if crop in self.manifest]
+        self._models = OrderedDict()
+        self._info = {}
+        self._lock = threading.Lock()
+        self._load_locks = {crop: threading.Lock() for crop in self.manifest}
+
+    @classmethod
+    def from_env(cls, loader=load_model_artifact):
+        manifest = load_manifest()
+        return cls(
+            manifest,
+            loader=loader,
+            backends=load_backend_specs(manifest),
+            max_models=int(os.getenv("MODEL_MAX_RESIDENT", "0")),
+            max_bytes=int(os.getenv("MODEL_MAX_BYTES", "0")),
+            preload=_env_list("MODEL_PRELOAD"),
+            fold_normalization=os.getenv("FOLD_NORMALIZATION", "false").lower() == "true",
+        )
+
+    def __contains__(self, crop_type):
+        return crop_type in self.manifest
+
+    def crop_types(self):
+        return list(self.manifest)
+
+    def get(self, crop_type):
+        """
+        Returns the model for `crop_type`, loading it if it is not resident.
+        """
+        if crop_type not in self.manifest:
+            raise KeyError(f"No model configured for crop type '{crop_type}'")
+
+        model = self._resident(crop_type)
+        if model is not None:
+            return model
+
+        # Only one thread loads a given crop; others wait for it and count as hits
+        with self._load_locks[crop_type]:
+            model = self._resident(crop_type)
+            if model is not None:
+                return model
+            return self._load(crop_type)
+
+    def accepts_uint8(self, crop_type):
+        """
+        True when the resident model for `crop_type` does its own input scaling.
+        """
+        with self._lock:
+            info = self._info.get(crop_type)
+            return bool(info and info.get("uint8_input"))
+
+    def artifact_path(self, crop_type):
+        """
+        File actually loaded for `crop_type` under its configured backend.
+        """
+        return artifact_path(self.manifest[crop_type], self.backends[crop_type])
+
+    def set_backend(self, crop_type, spec):
+        """
+        Switches a crop to another backend; the new artifact is loaded on next use.
+        """
+        parse_backend_spec(spec)
+        self.backends[crop_type] = spec
+        self.evict(crop_type)
+
+    def model_version(self, crop_type):
+        """
+        Identifies the model file currently on disk by backend, size and mtime, so
+        anything keyed on it (e.g. the prediction cache) goes stale when it changes.
+        """
+        backend = self.backends[crop_type].replace(":", "-")
+        try:
+            st = os.stat(self.artifact_path(crop_type))
+        except OSError:
+            return f"{backend}-unknown"
+        return f"{backend}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    def preload(self):
+        """
+        Loads the configured hot set (MODEL_PRELOAD).
+        """
+        for crop_type in self.preload_crops:
+            self.get(crop_type)
+
+    def evict(self, crop_type):
+        with self._lock:
+            if self._models.pop(crop_type, None) is not None:
+                self._info[crop_type]["resident"] = False
+                logging.info(f"Evicted '{crop_type}' model")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_models": self.max_models,
+                "max_bytes": self.max_bytes,
+                "resident": list(self._models),
+                "resident_bytes": sum(self._info[crop]["bytes"] for crop in self._models),
+                "models": {crop: dict(info) for crop, info in self._info.items()},
+            }
+
+    def _resident(self, crop_type):
+        # Returns the resident model, counting the hit, or None when it must be loaded
+        with self._lock:
+            model = self._models.get(crop_type)
+            if model is not None:
+                self._models.move_to_end(crop_type)
+                self._info[crop_type]["hits"] += 1
+            return model
+
+    def _load(self, crop_type):
+        path = self.artifact_path(crop_type)
+        logging.info(f"Loading '{crop_type}' model ({self.backends[crop_type]}) from {path}")
+        started = time.perf_counter()
+        model = self.loader(path)
+        uint8_input = False
+        if self.fold_normalization:
+            folded = fold_normalization(model)
+            if folded is not None:
+                model, uint8_input = folded, True
+        load_seconds = time.perf_counter() - started
+        nbytes = _model_nbytes(model)
+        logging.info(f"Loaded '{crop_type}' model in {load_seconds:.2f}s ({nbytes / 1e6:.1f} MB)")
+
+        with self._lock:
+            previous = self._info.get(crop_type, {})
+            self._info[crop_type] = {
+                "path": path,
+                "backend": self.backends[crop_type],
+                "uint8_input": uint8_input,
+                "resident": True,
+                "load_seconds": round(load_seconds, 4),
+                "bytes": nbytes,
+                "loads": previous.get("loads", 0) + 1,
+                "hits": previous.get("hits", 0),
+            }
+            self._models[crop_type] = model
+            self._evict_over_limit()
+        return model
+
+    def _evict_over_limit(self):
+        # Called with self._lock held; never evicts the most recently used model
+        def over_limit():
+            if self.max_models and len(self._models) > self.max_models:
+                return True
+            resident_bytes = sum(self._info[crop]["bytes"] for crop in self._models)
+            return bool(self.max_bytes) and resident_bytes > self.max_bytes
+
+        while len(self._models) > 1 and over_limit():
+            crop_type, _ = self._models.popitem(last=False)
+            self._info[crop_type]["resident"] = False
+            logging.info(f"Evicted '{crop_type}' model to stay within the registry limits")
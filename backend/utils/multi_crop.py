@@ -0,0 +1,157 @@
+"""
+Builds one serving graph for every crop: the layers the crop models share are
+kept once as a common trunk and each crop keeps its own head.
+
+Run from the backend directory:
+    python -m utils.multi_crop --output combined.keras
+    python -m utils.multi_crop --shared-layers 3 --reference corn --output combined.keras
+
+Without --shared-layers only layers with identical configuration and weights
+in every model are shared, so the combined graph gives the same predictions as
+the separate models. Forcing a deeper trunk (e.g. a pretrained backbone whose
+weights drifted during per-crop fine-tuning) reuses the reference crop's
+weights and changes the other crops' predictions; the parity report shows by
+how much. Serve the result with MODEL_SERVING_MODE=combined and
+COMBINED_MODEL_PATH pointing at it.
+"""
+import os
+import json
+import argparse
+import logging
+import numpy as np
+from utils.ml_integration import registry, dataset_dir, head_outputs
+from utils.convert_models import sample_images
+
+
+def _same_layer(a, b):
+    if type(a) is not type(b):
+        return False
+    config_a, config_b = dict(a.get_config()), dict(b.get_config())
+    config_a.pop("name", None)
+    config_b.pop("name", None)
+    if config_a != config_b:
+        return False
+    weights_a, weights_b = a.get_weights(), b.get_weights()
+    return len(weights_a) == len(weights_b) and all(
+        wa.shape == wb.shape and np.array_equal(wa, wb) for wa, wb in zip(weights_a, weights_b))
+
+
+def shared_prefix_length(models):
+    """
+    Number of leading layers that are identical (type, config and weights) in every model.
+    """
+    layer_lists = [model.layers for model in models.values()]
+    count = 0
+    for layers in zip(*layer_lists):
+        if not all(_same_layer(layers[0], other) for other in layers[1:]):
+            break
+        count += 1
+    return count
+
+
+def build_multi_crop_model(models, shared_layers=None, reference=None):
+    """
+    Combines {crop_type: Sequential model} into one functional model with an
+    output per crop, named after the crop. The first `shared_layers` layers
+    (default: the identical prefix) come from the `reference` crop's model.
+    """
+    import tensorflow as tf
+
+    crops = list(models)
+    reference = reference or crops[0]
+    if shared_layers is None:
+        shared_layers = shared_prefix_length(models)
+
+    input_shape = models[reference].input_shape[1:]
+    for crop_type, model in models.items():
+        if model.input_shape[1:] != input_shape:
+            raise ValueError(f"Model for '{crop_type}' takes {model.input_shape[1:]}, expected {input_shape}")
+
+    inputs = tf.keras.Input(shape=input_shape, name="image")
+    trunk = inputs
+    for layer in models[reference].layers[:shared_layers]:
+        trunk = layer(trunk)
+
+    outputs = {}
+    for crop_type in crops:
+        head = trunk
+        for layer in models[crop_type].layers[shared_layers:]:
+            head = layer(head)
+        outputs[crop_type] = tf.keras.layers.Identity(name=crop_type)(head)
+
+    logging.info(f"Combined {len(crops)} models with {shared_layers} shared layer(s) from '{reference}'")
+    return tf.keras.Model(inputs, outputs, name="multi_crop")
+
+
+def parity_check(models, combined, images_by_crop, batch_size=32):
+    """
+    Top-1 agreement between each crop's own model and its head in the combined model.
+    """
+    report = {}
+    for crop_type, (images, labels) in images_by_crop.items():
+        separate_top1, combined_top1 = [], []
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            separate_top1.append(np.argmax(models[crop_type].predict(batch, verbose=0), axis=1))
+            heads = head_outputs(combined, combined.predict(batch, verbose=0))
+            combined_top1.append(np.argmax(heads[crop_type], axis=1))
+        separate_top1 = np.concatenate(separate_top1)
+        combined_top1 = np.concatenate(combined_top1)
+        report[crop_type] = {
+            "images": int(len(images)),
+            "top1_agreement": float(np.mean(separate_top1 == combined_top1)),
+            "separate_accuracy": float(np.mean(separate_top1 == labels)),
+            "combined_accuracy": float(np.mean(combined_top1 == labels)),
+        }
+    return report
+
+
+def _parameter_count(model):
+    return int(sum(np.prod(w.shape) for w in model.get_weights()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a shared-trunk multi-crop serving model.")
+    parser.add_argument("--crops", nargs="*", default=registry.crop_types())
+    parser.add_argument("--output", required=True, help="where to save the combined .keras model")
+    parser.add_argument("--shared-layers", type=int, default=None,
+                        help="force this many leading layers into the shared trunk")
+    parser.add_argument("--reference", help="crop whose trunk weights are used (default: first crop)")
+    parser.add_argument("--dataset", default=dataset_dir)
+    parser.add_argument("--parity-samples", type=int, default=200, help="images per crop (0 to skip the check)")
+    parser.add_argument("--report", help="write the parity report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    from tensorflow.keras.models import load_model
+
+    models = {crop_type: load_model(registry.manifest[crop_type]) for crop_type in args.crops}
+    combined = build_multi_crop_model(models, args.shared_layers, args.reference)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    combined.save(args.output)
+
+    separate_params = sum(_parameter_count(model) for model in models.values())
+    combined_params = _parameter_count(combined)
+    print(f"Saved {args.output}: {combined_params:,} parameters "
+          f"({separate_params:,} across the separate models)")
+
+    report = {"parameters": {"separate": separate_params, "combined": combined_params}, "crops": {}}
+    if args.parity_samples:
+        images_by_crop = {}
+        for crop_type in args.crops:
+            try:
+                images_by_crop[crop_type] = sample_images(crop_type, args.parity_samples, args.dataset, seed=1)
+            except RuntimeError as e:
+                logging.warning(str(e))
+        report["crops"] = parity_check(models, combined, images_by_crop)
+        for crop_type, result in report["crops"].items():
+            print(f"{crop_type:<8} top-1 agreement {result['top1_agreement']:.4f}  "
+                  f"accuracy {result['separate_accuracy']:.4f} -> {result['combined_accuracy']:.4f}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,347 @@
+"""
+Perceptual-hash near-duplicate detection. Images are reduced to 64-bit pHash
+(or dHash) fingerprints and kept in BK-trees, which answer "any image within
+Hamming distance k?" without comparing against every stored fingerprint.
+
+Two users:
+  * the dataset index, built (and updated incrementally) over the training
+    folders for the dedupe report. Run from the backend directory:
+        python -m utils.near_duplicates --build [--dataset DIR]
+        python -m utils.near_duplicates --report [--distance 4] [--output dupes.json]
+  * the upload index, fed as uploads are scored, which lets the upload path
+    reuse a user's earlier prediction for a near-identical photo.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2 as cv
+import numpy as np
+
+NEAR_DUP_HASH = os.getenv("NEAR_DUP_HASH", "phash").lower()
+# Largest Hamming distance (of 64 bits) still treated as the same photo
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "4"))
+# Upload index: reuse is per user, bounded in users, entries per user and age
+NEAR_DUP_REUSE = os.getenv("NEAR_DUP_REUSE", "true").lower() == "true"
+NEAR_DUP_MAX_USERS = int(os.getenv("NEAR_DUP_MAX_USERS", "10000"))
+NEAR_DUP_PER_USER = int(os.getenv("NEAR_DUP_PER_USER", "500"))
+NEAR_DUP_TTL_S = float(os.getenv("NEAR_DUP_TTL_S", "86400"))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def _gray(image):
+    return cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def dhash(image, hash_size=8):
+    """
+    Difference hash: sign of the horizontal gradient on a (hash_size+1) x hash_size thumbnail.
+    """
+    small = cv.resize(_gray(image), (hash_size + 1, hash_size), interpolation=cv.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """
+    DCT hash: low-frequency DCT coefficients of a 32x32 thumbnail against their median.
+    """
+    size = hash_size * highfreq_factor
+    small = cv.resize(_gray(image), (size, size), interpolation=cv.INTER_AREA).astype(np.float32)
+    low = cv.dct(small)[:hash_size, :hash_size].flatten()
+    # The DC term only encodes overall brightness, so it is left out of the median
+    bits = low > np.median(low[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+HASH_FUNCTIONS = {"phash": phash, "dhash": dhash}
+
+
+def fingerprint(image, method=NEAR_DUP_HASH):
+    """
+    64-bit fingerprint of a decoded (BGR or grayscale) image.
+    """
+    return HASH_FUNCTIONS[method](image)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance. Each node keeps every item added
+    with its exact key; children are keyed by their distance to the node.
+    """
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key, item):
+        self.size += 1
+        if self.root is None:
+            self.root = (key, [item], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (key, [item], {})
+                return
+            node = child
+
+    def search(self, key, max_distance):
+        """
+        [(distance, key, item)] for every item within `max_distance`, closest first.
+        """
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_key, items, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= max_distance:
+                results.extend((distance, node_key, item) for item in items)
+            # Triangle inequality: only subtrees at distance d +/- max_distance can match
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(results, key=lambda result: result[0])
+
+
+class UploadIndex:
+    """
+    Recent upload fingerprints per user, each with the prediction made for it.
+    A user's tree is rebuilt when entries age out or exceed the per-user cap,
+    which is cheap at these sizes.
+    """
+    def __init__(self, enabled=NEAR_DUP_REUSE, max_distance=NEAR_DUP_MAX_DISTANCE, max_users=NEAR_DUP_MAX_USERS,
+                 per_user=NEAR_DUP_PER_USER, ttl_seconds=NEAR_DUP_TTL_S):
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.max_users = max_users
+        self.per_user = per_user
+        self.ttl_seconds = ttl_seconds
+        # user id -> (deque of (stored_at, key, entry), BKTree)
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def lookup(self, user_id, key, crop_type, version):
+        """
+        The closest earlier entry for this user, crop type and model version within
+        max_distance, as {"result", "image_hash", "distance"}; None otherwise.
+        """
+        with self._lock:
+            bucket = self._bucket(user_id, create=False)
+            matches = bucket[1].search(key, self.max_distance) if bucket else []
+            for distance, _, entry in matches:
+                if entry["crop_type"] == crop_type and entry["version"] == version:
+                    self._hits += 1
+                    return {"result": entry["result"], "image_hash": entry["image_hash"], "distance": distance}
+            self._misses += 1
+            return None
+
+    def add(self, user_id, key, crop_type, version, result, image_hash):
+        entry = {"crop_type": crop_type, "version": version, "result": result, "image_hash": image_hash}
+        with self._lock:
+            entries, tree = self._bucket(user_id, create=True)
+            entries.append((time.monotonic(), key, entry))
+            if len(entries) > self.per_user:
+                entries.popleft()
+                self._rebuild(user_id, entries)
+            else:
+                tree.add(key, entry)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_distance": self.max_distance,
+                "users": len(self._users),
+                "entries": sum(len(entries) for entries, _ in self._users.values()),
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+    def _bucket(self, user_id, create):
+        # Called with self._lock held; drops expired entries on the way
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            if not create:
+                return None
+            bucket = self._users[user_id] = (deque(), BKTree())
+        self._users.move_to_end(user_id)
+        entries = bucket[0]
+        if self.ttl_seconds and entries and time.monotonic() - entries[0][0] > self.ttl_seconds:
+            cutoff = time.monotonic() - self.ttl_seconds
+            while entries and entries[0][0] < cutoff:
+                entries.popleft()
+            bucket = self._rebuild(user_id, entries)
+        return bucket
+
+    def _rebuild(self, user_id, entries):
+        tree = BKTree()
+        for _, key, entry in entries:
+            tree.add(key, entry)
+        self._users[user_id] = (entries, tree)
+        return self._users[user_id]
+
+
+# Shared index used by the upload path
+upload_index = UploadIndex()
+
+
+def _hash_file(path, method):
+    # A reduced decode is plenty for a 32x32 fingerprint
+    image = cv.imread(path, cv.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        logging.warning(f"Skipping unreadable image {path}")
+        return None
+    return fingerprint(image, method)
+
+
+def build_file_index(root, index_path, method=NEAR_DUP_HASH, workers=None):
+    """
+    Fingerprints every image under `root` (one folder per class) into a JSON index,
+    reusing the stored fingerprint of files whose size and mtime are unchanged.
+    Returns (index, number of files hashed).
+    """
+    old = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            stored = json.load(f)
+        if stored.get("method") == method:
+            old = stored["files"]
+
+    files, pending = {}, {}
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4, thread_name_prefix="phash") as pool:
+        for folder in sorted(os.listdir(root)):
+            folder_path = os.path.join(root, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for entry in os.scandir(folder_path):
+                if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                rel = f"{folder}/{entry.name}"
+                stat = entry.stat()
+                previous = old.get(rel)
+                if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+                    files[rel] = previous
+                else:
+                    files[rel] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": None}
+                    pending[rel] = pool.submit(_hash_file, entry.path, method)
+        for rel, future in pending.items():
+            key = future.result()
+            files[rel]["hash"] = None if key is None else f"{key:016x}"
+
+    index = {"method": method, "root": os.path.abspath(root), "files": files}
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return index, len(pending)
+
+
+def duplicate_report(index, max_distance=NEAR_DUP_MAX_DISTANCE):
+    """
+    Groups the indexed files into near-duplicate clusters (connected components of
+    "within max_distance") and summarises them per class folder. Clusters spanning
+    several folders are listed separately: the same photo under different labels.
+    """
+    paths = [rel for rel, info in sorted(index["files"].items()) if info["hash"]]
+    keys = [int(index["files"][rel]["hash"], 16) for rel in paths]
+    tree = BKTree()
+    for i, key in enumerate(keys):
+        tree.add(key, i)
+
+    parent = list(range(len(paths)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, key in enumerate(keys):
+        for _, _, j in tree.search(key, max_distance):
+            if j > i:
+                parent[find(j)] = find(i)
+
+    clusters = {}
+    for i in range(len(paths)):
+        clusters.setdefault(find(i), []).append(paths[i])
+    clusters = sorted((members for members in clusters.values() if len(members) > 1), key=len, reverse=True)
+
+    per_folder = {}
+    cross_label = []
+    for members in clusters:
+        folders = {rel.split("/", 1)[0] for rel in members}
+        if len(folders) > 1:
+            cross_label.append(members)
+        for folder in folders:
+            count = sum(rel.startswith(folder + "/") for rel in members)
+            stats = per_folder.setdefault(folder, {"clusters": 0, "redundant_images": 0})
+            stats["clusters"] += 1
+            stats["redundant_images"] += count - 1
+    return {
+        "max_distance": max_distance,
+        "images": len(paths),
+        "clusters": len(clusters),
+        # Images that could be dropped while keeping one per cluster
+        "redundant_images": sum(len(members) - 1 for members in clusters),
+        "per_folder": dict(sorted(per_folder.items())),
+        "cross_label_clusters": cross_label,
+        "cluster_members": clusters,
+    }
+
+
+if __name__ == "__main__":
+    from utils.ml_integration import dataset_dir
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Near-duplicate index and dedupe report for the dataset.")
+    parser.add_argument("--build", action="store_true", help="create or update the fingerprint index")
+    parser.add_argument("--report", action="store_true", help="print the near-duplicate report")
+    parser.add_argument("--dataset", default=dataset_dir, help="dataset root with one folder per class")
+    parser.add_argument("--index", default=os.path.join(os.path.dirname(dataset_dir), "near_duplicates.json"))
+    parser.add_argument("--method", choices=sorted(HASH_FUNCTIONS), default=NEAR_DUP_HASH)
+    parser.add_argument("--distance", type=int, default=NEAR_DUP_MAX_DISTANCE, help="max Hamming distance")
+    parser.add_argument("--workers", type=int, default=None, help="hashing threads (default: CPU count)")
+    parser.add_argument("--output", help="write the full report as JSON to this file")
+    args = parser.parse_args()
+    if not (args.build or args.report):
+        parser.error("nothing to do: pass --build and/or --report")
+
+    if args.build:
+        started = time.perf_counter()
+        index, hashed = build_file_index(args.dataset, args.index, args.method, args.workers)
+        print(f"Indexed {len(index['files'])} images ({hashed} hashed) in {time.perf_counter() - started:.1f}s")
+    if args.report:
+        with open(args.index) as f:
+            index = json.load(f)
+        report = duplicate_report(index, args.distance)
+        print(f"{report['images']} images, {report['clusters']} near-duplicate clusters, "
+              f"{report['redundant_images']} redundant images (distance <= {args.distance})")
+        for folder, stats in report["per_folder"].items():
+            print(f"  {folder:<55} {stats['clusters']:>6} clusters  {stats['redundant_images']:>6} redundant")
+        if report["cross_label_clusters"]:
+            print(f"{len(report['cross_label_clusters'])} cluster(s) span several class folders, e.g.:")
+            for members in report["cross_label_clusters"][:5]:
+                print("  " + ", ".join(members[:4]))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {args.output}")
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# In-process tier limits (a TTL of 0 keeps entries until they are evicted)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "1024"))
+PREDICTION_CACHE_TTL_S = float(os.getenv("PREDICTION_CACHE_TTL_S", "3600"))
+# Optional SQLite tier (prediction_cache table) that survives restarts
+PREDICTION_CACHE_PERSIST = os.getenv("PREDICTION_CACHE_PERSIST", "false").lower() == "true"
+
+
+def image_digest(image):
+    """
+    sha256 hex digest of the raw uploaded bytes.
+    """
+    return hashlib.sha256(image).hexdigest()
+
+
+def cache_key(digest, crop_type, model_version):
+    return f"{digest}:{crop_type}:{model_version}"
+
+
+class PredictionCache:
+    """
+    Content-addressed cache of prediction results keyed on the image hash, crop
+    type and model version. Entries for a crop are dropped from both tiers as
+    soon as a request sees a new version of its model file.
+    """
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE, ttl_seconds=PREDICTION_CACHE_TTL_S,
+                 persistent=PREDICTION_CACHE_PERSIST):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._pending_purges = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self.persistent
+
+    def get_memory(self, key):
+        """
+        Looks the key up in the in-process tier only (never blocks on I/O).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self._counters["expirations"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return result
+
+    def get_persistent(self, key):
+        """
+        Looks the key up in the SQLite tier, promoting a hit into memory. Blocking.
+        """
+        if not self.persistent:
+            return None
+        from database import SessionLocal
+        from models import PredictionCacheEntry
+
+        db = SessionLocal()
+        try:
+            self._purge_stale_rows(db)
+            row = db.get(PredictionCacheEntry, key)
+            if row is None:
+                return None
+            result = json.loads(row.result)
+        finally:
+            db.close()
+
+        with self._lock:
+            self._counters["persistent_hits"] += 1
+        self._put_memory(key, result)
+        return result
+
+    def record_miss(self):
+        with self._lock:
+            self._counters["misses"] += 1
+
+    def put(self, key, crop_type, model_version, result):
+        """
+        Stores a result in memory and, when enabled, in the SQLite tier. Blocking
+        when the persistent tier is on.
+        """
+        self._put_memory(key, result)
+        if not self.persistent:
+            return
+        from database import SessionLocal
+        from models import PredictionCacheEntry
+
+        db = SessionLocal()
+        try:
+            db.merge(PredictionCacheEntry(key=key, crop_type=crop_type, model_version=model_version,
+                                          result=json.dumps(result)))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.warning(f"Failed to persist prediction cache entry: {e}")
+        finally:
+            db.close()
+
+    def check_version(self, crop_type, model_version):
+        """
+        Invalidates every in-memory entry for `crop_type` the first time a new model
+        version is seen. Stale SQLite rows are purged on the next persistent lookup,
+        so this never blocks on I/O.
+        """
+        with self._lock:
+            previous = self._versions.get(crop_type)
+            self._versions[crop_type] = model_version
+            if previous is None or previous == model_version:
+                if previous is None and self.persistent:
+                    self._pending_purges[crop_type] = model_version
+                return False
+            suffix = f":{crop_type}:{previous}"
+            for key in [key for key in self._entries if key.endswith(suffix)]:
+                del self._entries[key]
+            self._counters["invalidations"] += 1
+            if self.persistent:
+                self._pending_purges[crop_type] = model_version
+        logging.info(f"Model for '{crop_type}' changed, invalidating cached predictions")
+        return True
+
+    def _purge_stale_rows(self, db):
+        from models import PredictionCacheEntry
+
+        with self._lock:
+            purges, self._pending_purges = self._pending_purges, {}
+        for crop_type, model_version in purges.items():
+            db.query(PredictionCacheEntry).filter(
+                PredictionCacheEntry.crop_type == crop_type,
+                PredictionCacheEntry.model_version != model_version,
+            ).delete(synchronize_session=False)
+        if purges:
+            db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self.persistent,
+                "entries": len(self._entries),
+                **self._counters,
+            }
+
+    def _put_memory(self, key, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
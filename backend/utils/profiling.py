@@ -0,0 +1,139 @@
+import io
+import os
+import hmac
+import re
+import time
+import pstats
+import random
+import logging
+import cProfile
+import threading
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+# Off unless PROFILE_TOKEN is set (per-request opt-in via X-Profile-Token) or
+# PROFILE_SAMPLE_RATE > 0 (fraction of uploads profiled at random)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Oldest profiles are deleted once either limit is exceeded
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", str(100 * 1024 * 1024)))
+# Stack depth kept per allocation; deeper is more useful and slower
+PROFILE_TRACE_FRAMES = int(os.getenv("PROFILE_TRACE_FRAMES", "10"))
+
+_NAME_RE = re.compile(r"^[\w.-]+\.(prof|txt)$")
+
+
+class Profiler:
+    """
+    Captures a cProfile CPU profile of the calling thread and a tracemalloc
+    allocation diff around a block, and writes them to `directory` as
+    <stem>.prof (pstats, e.g. for snakeviz) and <stem>.txt (readable summary).
+    One capture runs at a time; overlapping requests are simply not profiled.
+    """
+    def __init__(self, directory=PROFILE_DIR, token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE,
+                 max_files=PROFILE_MAX_FILES, max_bytes=PROFILE_MAX_BYTES):
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._busy = threading.Lock()
+
+    def requested(self, token=None):
+        """
+        Whether to profile this request: a matching token, or the sampling rate.
+        Always False while another capture is running.
+        """
+        if self._busy.locked():
+            return False
+        if token is not None and self.token and hmac.compare_digest(token.encode(), self.token.encode()):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def capture(self, name):
+        """
+        Profiles the block; yields the file stem, or None when another capture is running.
+        """
+        if not self._busy.acquire(blocking=False):
+            yield None
+            return
+        safe_name = re.sub(r"[^\w.-]", "_", name)
+        stem = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}-{safe_name}"
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield stem
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            try:
+                self._write(stem, profile, before, after, elapsed, peak)
+            except Exception as e:
+                logging.error(f"Failed to write profile {stem}: {e}")
+            finally:
+                self._busy.release()
+
+    def run(self, name, fn, *args, **kwargs):
+        with self.capture(name):
+            return fn(*args, **kwargs)
+
+    def list(self):
+        """
+        Stored profile files, newest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        files = []
+        for entry in os.scandir(self.directory):
+            if _NAME_RE.match(entry.name):
+                stat = entry.stat()
+                files.append({"name": entry.name, "bytes": stat.st_size, "modified": stat.st_mtime})
+        return sorted(files, key=lambda f: f["modified"], reverse=True)
+
+    def path_for(self, name):
+        if not _NAME_RE.match(name):
+            raise ValueError("Invalid profile name")
+        return os.path.join(self.directory, name)
+
+    def _write(self, stem, profile, before, after, elapsed, peak):
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(os.path.join(self.directory, f"{stem}.prof"))
+
+        summary = io.StringIO()
+        summary.write(f"{stem}\nwall time: {elapsed * 1000:.1f} ms, traced peak: {peak / 1e6:.1f} MB\n\n")
+        summary.write("== CPU (top 40 by cumulative time)\n")
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(40)
+        summary.write("\n== Allocations (top 25 by size delta)\n")
+        for stat in after.compare_to(before, "lineno")[:25]:
+            summary.write(f"{stat}\n")
+        with open(os.path.join(self.directory, f"{stem}.txt"), "w") as f:
+            f.write(summary.getvalue())
+        self._enforce_limits()
+
+    def _enforce_limits(self):
+        files = self.list()
+        total = sum(f["bytes"] for f in files)
+        while files and (len(files) > self.max_files or total > self.max_bytes):
+            oldest = files.pop()
+            total -= oldest["bytes"]
+            try:
+                os.remove(os.path.join(self.directory, oldest["name"]))
+            except OSError:
+                pass
+
+
+# Shared profiler used by the upload endpoint
+profiler = Profiler()
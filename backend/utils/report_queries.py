@@ -0,0 +1,95 @@
+import json
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+from models import Report
+
+# Columns a caller may ask for; id and timestamp are always returned since the cursor needs them
+REPORT_COLUMNS = {
+    "id": Report.id,
+    "uid": Report.uid,
+    "crop_type": Report.crop_type,
+    "predicted_disease": Report.predicted_disease,
+    "solution": Report.solution,
+    "image_path": Report.image_path,
+    "image_hash": Report.image_hash,
+    "timestamp": Report.timestamp,
+    "user_id": Report.user_id,
+}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(timestamp, report_id):
+    payload = json.dumps([timestamp.isoformat() if timestamp else None, report_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns (timestamp, id) from a cursor made by encode_cursor, or raises ValueError.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, report_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(report_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def parse_columns(fields):
+    """
+    Maps a comma-separated field list (None for all) to the selected columns.
+    """
+    if not fields:
+        return list(REPORT_COLUMNS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in REPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown report field(s): {', '.join(unknown)}")
+    return ["id", "timestamp"] + [name for name in names if name not in ("id", "timestamp")]
+
+
+def filter_reports(query, user_id=None, uid=None, crop_type=None, disease=None, start=None, end=None):
+    """
+    Applies the report filters shared by the history API and the admin export.
+    """
+    if user_id is not None:
+        query = query.filter(Report.user_id == user_id)
+    if uid:
+        query = query.filter(Report.uid == uid)
+    if crop_type:
+        query = query.filter(Report.crop_type == crop_type)
+    if disease:
+        query = query.filter(Report.predicted_disease == disease)
+    if start:
+        query = query.filter(Report.timestamp >= start)
+    if end:
+        query = query.filter(Report.timestamp < end)
+    return query
+
+
+def query_reports(db, user_id=None, uid=None, crop_type=None, disease=None, start=None, end=None,
+                  cursor=None, limit=DEFAULT_PAGE_SIZE, columns=None):
+    """
+    One page of reports, newest first, as (rows, next_cursor). Paging is keyset on
+    (timestamp, id), so each page is an index range scan whatever its depth.
+    """
+    columns = columns or list(REPORT_COLUMNS)
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = filter_reports(db.query(*(REPORT_COLUMNS[name].label(name) for name in columns)),
+                           user_id=user_id, uid=uid, crop_type=crop_type, disease=disease, start=start, end=end)
+    if cursor:
+        timestamp, report_id = decode_cursor(cursor)
+        # The redundant "<=" bound keeps the lookup a range scan on the composite index
+        query = query.filter(Report.timestamp <= timestamp,
+                             or_(Report.timestamp < timestamp,
+                                 and_(Report.timestamp == timestamp, Report.id < report_id)))
+
+    # Fetch one extra row to know whether there is a next page
+    rows = query.order_by(Report.timestamp.desc(), Report.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return [dict(row._mapping) for row in rows], next_cursor
@@ -0,0 +1,128 @@
+import os
+import time
+import queue
+import logging
+import threading
+from database import SessionLocal
+
+# "sync" commits each report before the response; "batched" queues it and a
+# background thread writes many reports per transaction
+REPORT_DURABILITY = os.getenv("REPORT_DURABILITY", "sync").lower()
+# Flush once this many reports are queued, or this long after the first one
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "256"))
+REPORT_FLUSH_MS = float(os.getenv("REPORT_FLUSH_MS", "50"))
+# Seconds shutdown waits for queued reports to be written
+REPORT_DRAIN_TIMEOUT_S = float(os.getenv("REPORT_DRAIN_TIMEOUT_S", "10"))
+
+
+class ReportWriter:
+    """
+    Write-behind queue for Report rows. submit() returns the report's uid at once;
+    the rows are inserted later in multi-row batches, one transaction per batch.
+    A report that is queued but not yet written is lost if the process dies.
+    """
+    def __init__(self, batch_size=REPORT_BATCH_SIZE, flush_ms=REPORT_FLUSH_MS, session_factory=SessionLocal):
+        self.batch_size = max(1, int(batch_size))
+        self.flush_ms = float(flush_ms)
+        self.session_factory = session_factory
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # uid -> user_id of the reports queued but not yet written
+        self._pending = {}
+        self._thread = None
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_flush_ms = 0.0
+
+    def submit(self, report):
+        with self._lock:
+            self._pending[report.uid] = report.user_id
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="report-writer", daemon=True)
+                self._thread.start()
+        self._queue.put(report)
+        return report.uid
+
+    def is_pending(self, uid, user_id):
+        """
+        True while `user_id`'s report `uid` is queued; other users' reports never match.
+        """
+        with self._lock:
+            return uid in self._pending and self._pending[uid] == user_id
+
+    def drain(self, timeout=REPORT_DRAIN_TIMEOUT_S):
+        """
+        Blocks until every queued report is written, or `timeout` seconds pass.
+        Returns True when the queue was fully drained.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._pending:
+                    return True
+            time.sleep(0.01)
+        with self._lock:
+            remaining = len(self._pending)
+        logging.warning(f"Report writer drain timed out with {remaining} report(s) unwritten")
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "durability": REPORT_DURABILITY,
+                "pending": len(self._pending),
+                "written": self._written,
+                "failed": self._failed,
+                "batches": self._batches,
+                "last_flush_ms": round(self._last_flush_ms, 3),
+            }
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_ms / 1000.0
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        # Read before committing: committed rows are expired and detached afterwards
+        uids = [report.uid for report in batch]
+        written, failed = self._commit(batch)
+        # One bad row should not lose the rest of the batch: retry row by row
+        if failed:
+            written, failed = 0, 0
+            for report in batch:
+                ok, _ = self._commit([report])
+                written += ok
+                failed += not ok
+
+        with self._lock:
+            for uid in uids:
+                self._pending.pop(uid, None)
+            self._written += written
+            self._failed += failed
+            self._batches += 1
+            self._last_flush_ms = (time.perf_counter() - started) * 1000.0
+
+    def _commit(self, reports):
+        db = self.session_factory()
+        try:
+            # add_all + commit goes out as multi-row INSERTs ("insertmanyvalues")
+            db.add_all(reports)
+            db.commit()
+            return len(reports), 0
+        except Exception as e:
+            logging.error(f"Failed to write {len(reports)} report(s): {e}")
+            db.rollback()
+            return 0, len(reports)
+        finally:
+            db.close()
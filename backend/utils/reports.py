@@ -0,0 +1,23 @@
+import uuid
+from datetime import datetime, timezone
+from models import Report
+
+
+def build_report(crop_type, result, image_path=None, user_id=None, image_hash=None):
+    """
+    Creates (but does not add or commit) a Report row for a prediction result.
+    Results for the auto crop type carry the detected crop, which is stored instead.
+    """
+    solution = result.get("solution", {})
+    if isinstance(solution, dict):
+        solution = solution.get("Preventive Measures", "No preventive measures provided")
+    return Report(
+        uid=uuid.uuid4().hex,
+        crop_type=result.get("crop_type", crop_type),
+        image_path=image_path,
+        image_hash=image_hash,
+        predicted_disease=result.get("disease", "Unknown"),
+        solution=solution,
+        user_id=user_id,
+        timestamp=datetime.now(timezone.utc)  # Use timezone-aware datetime
+    )
@@ -0,0 +1,154 @@
+"""
+Per-day disease counts maintained alongside the reports table, so analytics
+queries scan days x diseases instead of every report.
+
+Counts are updated in the same flush (and therefore transaction) that inserts
+or deletes a Report. To recompute them from scratch, run from the backend directory:
+    python -m utils.rollups --rebuild
+"""
+import argparse
+import logging
+from collections import Counter
+from datetime import date, datetime, timezone
+from sqlalchemy import event, func, delete, update, insert
+from models import Report, DiseaseRollup
+
+
+def _day(timestamp):
+    return (timestamp or datetime.now(timezone.utc)).date()
+
+
+def _collect_deltas(session):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Report):
+            deltas[(obj.crop_type, obj.predicted_disease, _day(obj.timestamp))] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Report):
+            deltas[(obj.crop_type, obj.predicted_disease, _day(obj.timestamp))] -= 1
+    return deltas
+
+
+def apply_deltas(connection, deltas):
+    """
+    Adds {(crop_type, disease, day): delta} to the rollup counts.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        statement = upsert(DiseaseRollup)
+        statement = statement.on_conflict_do_update(
+            index_elements=["crop_type", "predicted_disease", "day"],
+            set_={"count": DiseaseRollup.count + statement.excluded.count})
+        connection.execute(statement, [
+            {"crop_type": crop, "predicted_disease": disease, "day": day, "count": delta}
+            for (crop, disease, day), delta in deltas.items()
+        ])
+        return
+    # Other databases: update, and insert the rows that did not exist yet
+    for (crop, disease, day), delta in deltas.items():
+        updated = connection.execute(
+            update(DiseaseRollup)
+            .where(DiseaseRollup.crop_type == crop, DiseaseRollup.predicted_disease == disease,
+                   DiseaseRollup.day == day)
+            .values(count=DiseaseRollup.count + delta))
+        if not updated.rowcount:
+            connection.execute(insert(DiseaseRollup).values(crop_type=crop, predicted_disease=disease,
+                                                            day=day, count=delta))
+
+
+def _after_flush(session, flush_context):
+    apply_deltas(session.connection(), _collect_deltas(session))
+
+
+def install(session_factory):
+    """
+    Keeps the rollups updated for every session made by `session_factory`.
+    """
+    if not event.contains(session_factory, "after_flush", _after_flush):
+        event.listen(session_factory, "after_flush", _after_flush)
+
+
+def rebuild_rollups(db):
+    """
+    Recomputes every rollup row from the reports table in one transaction.
+    Returns the number of rollup rows written.
+    """
+    day = func.date(Report.timestamp)
+    groups = (db.query(Report.crop_type, Report.predicted_disease, day, func.count(Report.id))
+              .group_by(Report.crop_type, Report.predicted_disease, day).all())
+    db.execute(delete(DiseaseRollup))
+    rows = [
+        {"crop_type": crop, "predicted_disease": disease,
+         "day": value if isinstance(value, date) else date.fromisoformat(value), "count": count}
+        for crop, disease, value, count in groups if value is not None
+    ]
+    if rows:
+        db.execute(insert(DiseaseRollup), rows)
+    db.commit()
+    logging.info(f"Rebuilt {len(rows)} disease rollup rows")
+    return len(rows)
+
+
+def backfill_if_empty(db):
+    """
+    Rebuilds the rollups when the table is empty but reports exist, e.g. right
+    after the rollup table was added to an existing database.
+    """
+    if db.query(DiseaseRollup.day).first() is None and db.query(Report.id).first() is not None:
+        return rebuild_rollups(db)
+    return 0
+
+
+def query_rollups(db, start=None, end=None, crop_type=None, top=10):
+    """
+    Top `top` (crop, disease) pairs by report count between `start` and `end`
+    (inclusive days), with the per-day totals over the same range.
+    """
+    filters = []
+    if start:
+        filters.append(DiseaseRollup.day >= start)
+    if end:
+        filters.append(DiseaseRollup.day <= end)
+    if crop_type:
+        filters.append(DiseaseRollup.crop_type == crop_type)
+
+    total = func.sum(DiseaseRollup.count).label("count")
+    top_rows = (db.query(DiseaseRollup.crop_type, DiseaseRollup.predicted_disease, total)
+                .filter(*filters)
+                .group_by(DiseaseRollup.crop_type, DiseaseRollup.predicted_disease)
+                .having(total > 0)
+                .order_by(total.desc())
+                .limit(top).all())
+    daily_rows = (db.query(DiseaseRollup.day, total)
+                  .filter(*filters)
+                  .group_by(DiseaseRollup.day)
+                  .order_by(DiseaseRollup.day).all())
+    return {
+        "top": [{"crop_type": crop, "disease": disease, "count": int(count)} for crop, disease, count in top_rows],
+        "daily": [{"day": day.isoformat(), "count": int(count)} for day, count in daily_rows],
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the disease rollup table.")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every rollup row from the reports")
+    args = parser.parse_args()
+
+    from database import SessionLocal, Base, engine
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            print(f"Rebuilt {rebuild_rollups(db)} rollup rows")
+        else:
+            print(query_rollups(db))
+    finally:
+        db.close()
@@ -0,0 +1,269 @@
+"""
+Continuous prediction over a WebSocket for cameras that send frames non-stop.
+
+A client opens /stream?crop_type=corn[&token=<bearer token>] and sends each
+encoded JPEG/PNG frame as one binary message. The server answers with JSON:
+    {"type": "ready", "crop_type", "max_in_flight", "stable_frames"}
+    {"type": "prediction", "frame", "result", "latency_ms", "dropped", "state"}
+    {"type": "error", "frame", "status_code", "detail"}
+
+Frames are never queued per session: while STREAM_MAX_IN_FLIGHT frames are being
+scored, a newly arrived frame replaces the one waiting (latest frame wins), so a
+slow server answers fewer frames instead of falling behind. The frames being
+scored go through the shared batch scheduler, where they are batched with each
+other and with every other stream and upload.
+
+A Report is written only when the stream's state changes, i.e. when a new
+disease has been the answer for STREAM_STABLE_FRAMES frames in a row; the
+prediction message of that frame carries its report_uid.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+from fastapi import WebSocketDisconnect
+from utils.ml_integration import predict_disease_async
+from utils.inference_executor import QueueFullError, DeadlineExceededError, deadline_after
+from utils.ingest import ingest_bytes, UploadRejectedError, UPLOAD_MAX_BYTES
+from utils.reports import build_report
+from utils.metrics import metrics_registry, Counter as MetricCounter, Gauge
+
+# Frames of one session being decoded/scored at once; 2 overlaps decoding a
+# frame with the forward pass of the previous one
+STREAM_MAX_IN_FLIGHT = int(os.getenv("STREAM_MAX_IN_FLIGHT", "2"))
+# Consecutive frames that must agree before the stream's state (and report) changes
+STREAM_STABLE_FRAMES = int(os.getenv("STREAM_STABLE_FRAMES", "3"))
+# A frame not answered within this many seconds is stale and skipped
+STREAM_FRAME_TIMEOUT_S = float(os.getenv("STREAM_FRAME_TIMEOUT_S", "5"))
+STREAM_MAX_FRAME_BYTES = int(os.getenv("STREAM_MAX_FRAME_BYTES", str(UPLOAD_MAX_BYTES)))
+STREAM_MAX_SESSIONS = int(os.getenv("STREAM_MAX_SESSIONS", "64"))
+
+stream_frames = metrics_registry.register(MetricCounter(
+    "crop_disease_stream_frames", "Streamed frames by what happened to them.", ("crop_type", "outcome")))
+
+
+class DiseaseStateTracker:
+    """
+    Debounces per-frame answers into a stream state: a label becomes the state once
+    it is the answer of `stable_frames` consecutive frames, so a single
+    misclassified frame does not flip it.
+    """
+    def __init__(self, stable_frames=STREAM_STABLE_FRAMES):
+        self.stable_frames = max(1, int(stable_frames))
+        self.state = None
+        self.frames_in_state = 0
+        self._candidate = None
+        self._streak = 0
+
+    def update(self, label):
+        """
+        Feeds one frame's label; returns True when it changes the state.
+        """
+        if label == self.state:
+            self.frames_in_state += 1
+            self._candidate, self._streak = None, 0
+            return False
+        if label == self._candidate:
+            self._streak += 1
+        else:
+            self._candidate, self._streak = label, 1
+        if self._streak < self.stable_frames:
+            return False
+        self.state, self.frames_in_state = label, self._streak
+        self._candidate, self._streak = None, 0
+        return True
+
+
+class StreamSession:
+    """
+    One accepted WebSocket. `save_report` is an async callable that persists a
+    Report and returns its uid.
+    """
+    def __init__(self, websocket, crop_type, save_report, user_id=None,
+                 max_in_flight=STREAM_MAX_IN_FLIGHT, stable_frames=STREAM_STABLE_FRAMES):
+        self.websocket = websocket
+        self.crop_type = crop_type
+        self.save_report = save_report
+        self.user_id = user_id
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.tracker = DiseaseStateTracker(stable_frames)
+        self.counts = Counter()
+        self.started = time.monotonic()
+        self._latest = None
+        self._closed = False
+        self._sequence = 0
+        self._last_answered = 0
+        self._arrived = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._send_lock = asyncio.Lock()
+
+    async def run(self):
+        """
+        Serves the session until the client disconnects.
+        """
+        await self._send({"type": "ready", "crop_type": self.crop_type, "max_in_flight": self.max_in_flight,
+                          "stable_frames": self.tracker.stable_frames})
+        receiver = asyncio.create_task(self._receive())
+        tasks = set()
+        try:
+            while True:
+                await self._slots.acquire()
+                frame = await self._next_frame()
+                if frame is None:
+                    break
+                task = asyncio.create_task(self._process(*frame))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            # Answers for a client that is gone are not worth the forward pass
+            receiver.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(receiver, *tasks, return_exceptions=True)
+
+    def stats(self):
+        state = self.tracker.state
+        return {
+            "crop_type": self.crop_type,
+            "seconds": round(time.monotonic() - self.started, 1),
+            "state": state[1] if state else None,
+            **self.counts,
+        }
+
+    def _count(self, outcome):
+        self.counts[outcome] += 1
+        stream_frames.inc(crop_type=self.crop_type, outcome=outcome)
+
+    async def _receive(self):
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                data = message.get("bytes")
+                if data is None:
+                    await self._send({"type": "error", "status_code": 400,
+                                      "detail": "Frames must be sent as binary messages"})
+                    continue
+                self._sequence += 1
+                self._count("received")
+                if self._latest is not None:
+                    # Latest frame wins: the older frame was never started, so it is skipped
+                    self._count("dropped")
+                self._latest = (self._sequence, data, time.perf_counter())
+                self._arrived.set()
+        finally:
+            self._closed = True
+            self._arrived.set()
+
+    async def _next_frame(self):
+        while self._latest is None and not self._closed:
+            self._arrived.clear()
+            await self._arrived.wait()
+        if self._closed:
+            return None
+        frame, self._latest = self._latest, None
+        return frame
+
+    async def _process(self, sequence, data, received_at):
+        try:
+            try:
+                image = ingest_bytes(data, STREAM_MAX_FRAME_BYTES)
+            except UploadRejectedError as e:
+                self._count("rejected")
+                await self._send({"type": "error", "frame": sequence, "status_code": e.status_code,
+                                  "detail": e.detail})
+                return
+            try:
+                # Frames are near-unique, so they bypass the prediction cache
+                result = await predict_disease_async(self.crop_type, image.data, use_cache=False,
+                                                     deadline=deadline_after(STREAM_FRAME_TIMEOUT_S))
+            except (QueueFullError, DeadlineExceededError):
+                # Shed under load; the camera will have sent a newer frame by now
+                self._count("dropped")
+                return
+            if "error" in result:
+                self._count("failed")
+                await self._send({"type": "error", "frame": sequence, "status_code": 500, "detail": result["error"]})
+                return
+            if sequence < self._last_answered:
+                # A newer frame was answered first; this one would move the state backwards
+                self._count("stale")
+                return
+            self._last_answered = sequence
+            self._count("processed")
+
+            message = {"type": "prediction", "frame": sequence, "result": result,
+                       "latency_ms": round((time.perf_counter() - received_at) * 1000.0, 1),
+                       "dropped": self.counts["dropped"]}
+            if self.tracker.update((result.get("crop_type", self.crop_type), result["disease"])):
+                report = build_report(self.crop_type, result, user_id=self.user_id)
+                message["report_uid"] = await self.save_report(report)
+                self._count("reports")
+            crop_type, disease = self.tracker.state or (None, None)
+            message["state"] = {"crop_type": crop_type, "disease": disease, "frames": self.tracker.frames_in_state}
+            await self._send(message)
+        finally:
+            self._slots.release()
+
+    async def _send(self, message):
+        if self._closed:
+            return
+        async with self._send_lock:
+            try:
+                await self.websocket.send_json(message)
+            except (WebSocketDisconnect, RuntimeError):
+                self._closed = True
+                self._arrived.set()
+
+
+class StreamRegistry:
+    """
+    Tracks open sessions (at most `max_sessions`) and totals over closed ones.
+    """
+    def __init__(self, max_sessions=STREAM_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._active = set()
+        self._totals = Counter()
+        self._sessions = 0
+
+    def open(self, session):
+        with self._lock:
+            if len(self._active) >= self.max_sessions:
+                return False
+            self._active.add(session)
+            self._sessions += 1
+            return True
+
+    def close(self, session):
+        with self._lock:
+            self._active.discard(session)
+            self._totals.update(session.counts)
+        logging.info(f"Stream closed: {session.stats()}")
+
+    def active_count(self):
+        with self._lock:
+            return len(self._active)
+
+    def stats(self):
+        with self._lock:
+            active = [session.stats() for session in self._active]
+            totals = Counter(self._totals)
+        for session in active:
+            totals.update({key: value for key, value in session.items() if isinstance(value, int)})
+        return {
+            "max_sessions": self.max_sessions,
+            "sessions": self._sessions,
+            "active": active,
+            "frames": dict(totals),
+        }
+
+
+# Open streaming sessions, shared by the /stream endpoint and its stats
+stream_sessions = StreamRegistry()
+
+metrics_registry.register(Gauge(
+    "crop_disease_stream_sessions", "Open streaming sessions.", stream_sessions.active_count))